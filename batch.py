@@ -0,0 +1,276 @@
+"""Solves many matrices by running SequenceSolver on each one in a pool of worker processes.
+
+Run with Nengo's command line interpreter, e.g.
+
+    nengo-cl batch.py matrices/ -o results.txt
+    nengo-cl batch.py manifest.txt --workers 8 --math
+    nengo-cl batch.py matrices/ --compile matrices.corpus
+    nengo-cl batch.py matrices.corpus
+
+where the input is either a folder of matrix files, a manifest file listing one matrix
+file per line, or a corpus compiled from those with --compile (so the matrices don't
+have to be parsed and encoded again by every worker; compile it with the same --dimensions
+and --seed as the runs that use it). Each matrix is solved in its own process with its own JOB_ID and data
+folder (data/<folder>/job_<JOB_ID>), so workers never write to each other's files. The
+chosen answer, its score and the time taken for each matrix are collected into one
+tab-separated results table."""
+
+import os
+import sys
+import time
+import subprocess
+from optparse import OptionParser
+
+from java.lang import System
+from java.lang import Runtime
+
+CURR_LOCATION = os.path.dirname(os.path.abspath(sys.argv[0]))
+sys.path.append(CURR_LOCATION)
+
+from misc import RPMutils
+
+#columns of the results table
+RESULT_COLUMNS = ["matrix", "job", "answer", "confidence", "time", "scores"]
+
+def corpusEntry(corpusfile, index):
+    """Returns the name of the indexth matrix in a compiled corpus (in place of a matrix file)."""
+
+    return corpusfile + "#" + str(index)
+
+def splitCorpusEntry(matrixfile):
+    """Returns the corpus file and index of a corpus entry, or (None, None) for a matrix file."""
+
+    from misc import matrixhandler
+
+    if "#" not in matrixfile:
+        return None, None
+
+    #a matrix file can have # in its name, so only split entries of an actual corpus
+    corpusfile, index = matrixfile.rsplit("#", 1)
+    if not index.isdigit() or not matrixhandler.isCorpus(corpusfile):
+        return None, None
+    return corpusfile, int(index)
+
+def findMatrices(path):
+    """Returns the matrix files in the given folder, or listed in the given manifest file (or
+    the entries of the given compiled corpus)."""
+
+    from misc import matrixhandler
+
+    if matrixhandler.isCorpus(path):
+        corpusfile = os.path.abspath(path)
+        return [corpusEntry(corpusfile, i) for i in range(len(matrixhandler.MatrixCorpus(corpusfile)))]
+
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".txt")]
+
+    folder = os.path.dirname(os.path.abspath(path))
+    input = open(path)
+    lines = [line.strip() for line in input]
+    input.close()
+
+    return [os.path.join(folder, line) for line in lines if line != "" and not line.startswith("#")]
+
+def workerMemory(options):
+    """Returns the maximum heap (in MB) for each worker, by default an equal share of this JVM's."""
+
+    if options.memory != None:
+        return options.memory
+    return Runtime.getRuntime().maxMemory() / (1024*1024) / max(options.workers, 1)
+
+def workerCommand(args, memory):
+    """Returns the command to run this script with the given arguments in a new JVM with a
+    maximum heap of memory MB."""
+
+    java = os.path.join(System.getProperty("java.home"), "bin", "java")
+    command = [java, "-Xmx" + str(memory) + "m",
+               "-cp", System.getProperty("java.class.path")]
+    if System.getProperty("python.home") != None:
+        command = command + ["-Dpython.home=" + System.getProperty("python.home")]
+
+    return command + ["org.python.util.jython", os.path.abspath(sys.argv[0])] + args
+
+def jobFolder(folder, jobid):
+    return os.path.join(folder, "job_" + str(jobid))
+
+def solveMatrix(matrixfile, options):
+    """Solves one matrix, returning the chosen answer, its score and all the scores."""
+
+    from misc import vocabulary
+    from misc import matrixhandler
+    from networks import sequencesolver
+    from networks import mathsolver
+
+    d = options.dimensions
+    N = d*RPMutils.NEURONS_PER_DIMENSION
+
+    corpusfile, index = splitCorpusEntry(matrixfile)
+    if corpusfile != None:
+        #the matrix was encoded when the corpus was compiled
+        corpus = matrixhandler.MatrixCorpus(corpusfile)
+        if corpus.d != d:
+            #(the encoded vectors can't be used by a network of a different size, so the job fails)
+            System.err.println("Error, " + corpusfile + " was compiled with " + str(corpus.d) + " dimensions, not " + str(d))
+            sys.exit(1)
+        matrix = corpus.getEncoded(index)
+    else:
+        vocab = vocabulary.genVocab(d, RPMutils.VOCAB_SIZE, options.seed)
+        mhandler = matrixhandler.MatrixHandler(matrixfile, vocab)
+        matrix = mhandler.encodeAll()
+
+    if options.math:
+        scores = mathsolver.MathSequenceSolver(d, matrix).scores()
+    else:
+        solver = sequencesolver.makeSequenceSolver(N, d, matrix, options.seed)
+        solver.run(0.0, 5*RPMutils.STEP_SIZE)
+
+        probe = RPMutils.findMatchingProbes(solver.simulator.getProbes(), "testSimilarity")[0]
+        values = probe.getData().getValues()
+        scores = list(values[len(values)-1])
+
+    answer = scores.index(max(scores))
+    return answer, scores[answer], scores
+
+def runWorker(jobid, matrixfile, outputfile, options):
+    """Solves one matrix in this process and writes a row of the results table to outputfile."""
+
+    RPMutils.CURR_LOCATION = CURR_LOCATION
+    RPMutils.RUN_WITH_CONTROLLER = False
+    RPMutils.JOB_ID = jobid
+    RPMutils.FOLDER_NAME = jobFolder(options.folder, jobid)
+    RPMutils.NUM_THREADS = options.threads
+    RPMutils.setThreads()
+
+    datafolder = os.path.join(CURR_LOCATION, "data", RPMutils.FOLDER_NAME)
+    if not os.path.exists(datafolder):
+        os.makedirs(datafolder)
+
+    start = time.time()
+    answer, confidence, scores = solveMatrix(matrixfile, options)
+    walltime = time.time() - start
+
+    output = open(outputfile, "w")
+    output.write("\t".join([matrixfile, str(jobid), str(answer+1), str(confidence), str(walltime),
+                            RPMutils.floatlist2str(scores)]) + "\n")
+    output.close()
+
+def runBatch(matrixfiles, options):
+    """Solves each matrix in a worker process, running up to options.workers at a time.
+
+    Returns the rows of the results table."""
+
+    resultfolder = os.path.join(CURR_LOCATION, "data", options.folder)
+    if not os.path.exists(resultfolder):
+        os.makedirs(resultfolder)
+
+    workerargs = ["--dimensions", str(options.dimensions), "--seed", str(options.seed), "--folder", options.folder,
+                  "--threads", str(options.threads)]
+    if options.math:
+        workerargs = workerargs + ["--math"]
+
+    memory = workerMemory(options)
+
+    pending = list(enumerate(matrixfiles))
+    pending.reverse()
+    running = []
+    results = [None for f in matrixfiles]
+
+    while pending or running:
+        #start new workers while there are free slots
+        while pending and len(running) < options.workers:
+            jobid, matrixfile = pending.pop()
+            outputfile = os.path.join(resultfolder, "result_" + str(jobid) + ".txt")
+            if os.path.exists(outputfile):
+                os.remove(outputfile)
+
+            process = subprocess.Popen(workerCommand(workerargs + ["--worker", str(jobid), "--result", outputfile, matrixfile], memory))
+            running.append((process, jobid, matrixfile, outputfile))
+
+        time.sleep(0.1)
+
+        #collect the workers that have finished
+        for job in list(running):
+            process, jobid, matrixfile, outputfile = job
+            if process.poll() == None:
+                continue
+            running.remove(job)
+
+            if process.returncode == 0 and os.path.exists(outputfile):
+                input = open(outputfile)
+                results[jobid] = input.readline().rstrip("\n").split("\t")
+                input.close()
+            else:
+                System.err.println("Error, worker for " + matrixfile + " failed with exit code " + str(process.returncode))
+                results[jobid] = [matrixfile, str(jobid), "", "", "", ""]
+
+    return results
+
+def compileCorpus(matrixfiles, filename, options):
+    """Parses and encodes the matrices in matrixfiles (with the vocabulary for options.dimensions
+    and options.seed) into a compiled corpus."""
+
+    from misc import vocabulary
+    from misc import matrixhandler
+
+    RPMutils.CURR_LOCATION = CURR_LOCATION
+    vocab = vocabulary.genVocab(options.dimensions, RPMutils.VOCAB_SIZE, options.seed)
+    return matrixhandler.compileMatrices(matrixfiles, vocab, filename)
+
+def saveResults(results, filename):
+    """Writes the results table to file."""
+
+    output = open(filename, "w")
+    output.write("\t".join(RESULT_COLUMNS) + "\n")
+    for row in results:
+        output.write("\t".join(row) + "\n")
+    output.close()
+
+def main(args):
+    parser = OptionParser(usage="%prog [options] (matrix folder | manifest file)")
+    parser.add_option("-o", "--output", help="file to write the results table to (default data/<folder>/results.txt)")
+    parser.add_option("-w", "--workers", type="int", default=Runtime.getRuntime().availableProcessors(),
+                      help="number of worker processes (default one per core)")
+    parser.add_option("--memory", type="int",
+                      help="maximum heap of each worker in MB (default an equal share of this JVM's)")
+    parser.add_option("-d", "--dimensions", type="int", default=RPMutils.VECTOR_DIMENSION)
+    parser.add_option("-s", "--seed", type="int", default=107, help="vocabulary seed")
+    parser.add_option("-t", "--threads", type="int", default=RPMutils.NUM_THREADS,
+                      help="threads each worker simulates with (default NUM_THREADS)")
+    parser.add_option("-f", "--folder", default="batch", help="data folder for the batch (under data/)")
+    parser.add_option("-m", "--math", action="store_true", default=False,
+                      help="solve with the math version of the model instead of the network")
+    parser.add_option("-c", "--compile", metavar="FILE",
+                      help="compile the matrices into a corpus file (instead of solving them)")
+    parser.add_option("--worker", type="int", help="(internal) solve a single matrix as the given job")
+    parser.add_option("--result", help="(internal) file for a worker's result")
+    options, args = parser.parse_args(args)
+
+    if len(args) != 1:
+        parser.error("expected one matrix folder or manifest file")
+
+    if options.worker != None:
+        runWorker(options.worker, args[0], options.result, options)
+        return
+
+    matrixfiles = findMatrices(args[0])
+
+    if options.compile != None:
+        count = compileCorpus(matrixfiles, options.compile, options)
+        if count == None:
+            System.err.println("Error, could not compile the matrices into " + options.compile)
+            sys.exit(1)
+        System.out.println("Compiled " + str(count) + " matrices into " + options.compile)
+        return
+
+    start = time.time()
+    results = runBatch(matrixfiles, options)
+
+    output = options.output
+    if output == None:
+        output = os.path.join(CURR_LOCATION, "data", options.folder, "results.txt")
+    saveResults(results, output)
+
+    System.out.println("Solved " + str(len(matrixfiles)) + " matrices in " + str(time.time() - start) + "s, results in " + output)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -7,13 +7,23 @@ import os
 from ca.nengo.model import SimulationMode
 from ca.nengo.model import Units
 from ca.nengo.model.impl import FunctionInput
+from ca.nengo.model.impl import EnsembleTermination
 from ca.nengo.model.nef.impl import NEFEnsembleFactoryImpl
 from ca.nengo.math import PDFTools
 from ca.nengo.math.impl import IndicatorPDF
 from ca.nengo.math.impl import GaussianPDF
 from ca.nengo.math.impl import ConstantFunction
+from ca.nengo.util.impl import NodeThreadPool
 
+from java.io import File
+from java.io import IOException
 from java.lang import System
+from java.lang import String
+from java.security import MessageDigest
+
+from misc import fft
+from misc import hrr
+from misc import vectorgenerators
 
 
 #note: the following are all constants, in that they are set for a given model.
@@ -56,6 +66,28 @@ RUN_WITH_CONTROLLER = True
 #the maximum similarity we will allow when generating a set of vectors
 VECTOR_SIMILARITY = 1.0
 
+#whether or not to keep generated vocabularies in a binary cache on disk
+CACHE_VOCAB = True
+
+#whether or not ensembles with the same dimension share one set of eval points
+SHARE_EVAL_POINTS = False
+
+#whether or not to save shared eval points to disk and reuse them in later runs
+PERSIST_EVAL_POINTS = False
+
+#whether or not to save built networks to snapshots on disk, and load them instead of rebuilding
+USE_SNAPSHOTS = False
+
+#whether or not to leave out the DIRECT mode relay ensembles on the inputs of networks, connecting
+#the inputs straight to the terminations the relays would have fed. networks split by dimension
+#also leave out their output relays, putting the populations in an array (see ensemblearray)
+#whose origin concatenates their outputs. this removes a (very short) synaptic filter.
+COLLAPSE_RELAYS = False
+
+#whether or not identical 1-dimensional sub-populations are cloned from one template (so that
+#their neurons and decoders are only generated once), rather than each being sampled independently
+REUSE_POPULATIONS = False
+
 #if running jobs concurrently, use this to ensure they don't use overlapping data files
 JOB_ID = 0
 
@@ -68,7 +100,7 @@ USE_CLEANUP = False
 #whether or not to update the cleanup memory after a run
 DYNAMIC_MEMORY = False
 
-#the number of threads we want to run with
+#the number of threads we want to run with (0 leaves Nengo's default, 1 runs single threaded)
 NUM_THREADS = 0
 
 #whether or not to split n-dimensional populations into n 1-dimensional populations
@@ -115,6 +147,37 @@ def getParameterSettings():
     parms = [[keys[i],values[i]] for i,key in enumerate(keys) if key.isupper()]
     return ",".join(["=".join([str(x) for x in pair]) for pair in parms]) 
 
+#parameters that don't affect the structure of the networks built (just where and how they are run)
+RUNTIME_PARAMETERS = ["CURR_LOCATION", "FOLDER_NAME", "JOB_ID", "NUM_THREADS", "CACHE_VOCAB", "USE_SNAPSHOTS", 
+                      "PERSIST_EVAL_POINTS", "RUNTIME_PARAMETERS"]
+
+#returns a digest of the source of the modules that build the networks (the misc and networks
+#packages), so that anything saved from built networks is invalidated when the code changes
+def codeVersion():
+    global _codeVersion
+    if _codeVersion == None:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        digest = MessageDigest.getInstance("MD5")
+        for package in ["misc", "networks"]:
+            files = [f for f in os.listdir(os.path.join(root, package)) if f.endswith(".py")]
+            files.sort()
+            for f in files:
+                input = open(os.path.join(root, package, f), "rb")
+                digest.update(String(package + "/" + f + "\n" + input.read()).getBytes("UTF-8"))
+                input.close()
+        _codeVersion = "".join(["%02x" % (b & 0xff) for b in digest.digest()])
+    return _codeVersion
+
+_codeVersion = None
+
+#returns a string (in a fixed order) of the parameters that affect the networks built (and the
+#version of the code that builds them)
+def getStructuralSettings():
+    parms = globals()
+    keys = [key for key in parms.keys() if key.isupper() and key not in RUNTIME_PARAMETERS]
+    keys.sort()
+    return ",".join([key + "=" + str(parms[key]) for key in keys] + ["code=" + codeVersion()])
+
 #output from origin (used to update cleanup memory)
 def cleanupDataFile():
     return os.path.join(CURR_LOCATION, "data", FOLDER_NAME, "cleanupoutputdata_" + str(JOB_ID) + ".txt")
@@ -123,6 +186,19 @@ def cleanupDataFile():
 def vocabFile(d, numwords, seed):
     return os.path.join(CURR_LOCATION, "data", FOLDER_NAME, "RPMvocab_" + str(numwords) + "x" + str(d) + "_" + str(seed) + ".txt")
 
+#binary cache of a generated vocabulary (shared between jobs, so not in FOLDER_NAME)
+def vocabCacheFile(d, numwords, seed):
+    return os.path.join(CURR_LOCATION, "data", "cache", "RPMvocab_" + str(numwords) + "x" + str(d) + "_" + str(seed) + ".npy")
+
+#folder for eval points saved between runs (shared between jobs, so not in FOLDER_NAME)
+def evalPointCacheFolder():
+    return os.path.join(CURR_LOCATION, "data", "cache")
+
+#snapshot of a built network (keyed by its size, the vocabulary seed and the structural parameters)
+def snapshotFile(name, N, d, seed):
+    settings = "%08x" % (String(getStructuralSettings()).hashCode() & 0xffffffffL)
+    return os.path.join(CURR_LOCATION, "data", "cache", name + "_" + str(N) + "x" + str(d) + "_" + str(seed) + "_" + settings + ".ser")
+
 #file containing vectors in cleanup memory
 def cleanupFile(d, numwords):
     return os.path.join(CURR_LOCATION, "data", FOLDER_NAME, "cleanup_" + str(numwords) + "x" + str(d) + "_" + str(JOB_ID) + ".txt")
@@ -150,6 +226,49 @@ def eye(d, val):
         identity[i][i] = val
     return(identity)
 
+#returns the matrix product of A and B
+def matrixProduct(A, B):
+    cols = zip(*B)
+    return [[sum([a*b for a,b in zip(row, col)]) for col in cols] for row in A]
+
+#exposes terminations (which all receive the same input, and so must have the same dimension) as
+#a single termination of network, in place of a relay ensemble that would feed them all
+def exposeTerminations(network, terminations, name):
+    network.exposeTermination(EnsembleTermination(network, name, terminations), name)
+
+#writes filename by calling write with the name of a temporary file in the same folder, and then
+#moving that into place, so that concurrent jobs never read a partially written file. the folder
+#is created if needed and the temporary file is always removed. returns True if the file was written.
+def writeAtomically(filename, write):
+    folder = os.path.dirname(filename)
+    if folder and not os.path.exists(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            pass #another job may have created it in the meantime
+    
+    tmpname = None
+    try:
+        try:
+            tmpname = File.createTempFile(os.path.basename(filename) + ".", ".tmp", File(folder or ".")).getPath()
+            write(tmpname)
+        except (IOError, OSError, IOException), e:
+            System.err.println("Warning, could not write " + filename + ": " + str(e))
+            return False
+        
+        try:
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpname, filename)
+        except OSError:
+            if not os.path.exists(filename):
+                System.err.println("Warning, could not write " + filename)
+                return False
+        return True
+    finally:
+        if tmpname != None and os.path.exists(tmpname):
+            os.remove(tmpname)
+
 def str2floatlist(str):
     return [float(word) for word in str.split()]
     
@@ -166,26 +285,18 @@ def genVector(d):
 
 #creates a function which outputs a random unit vector
 def makeInputVector(name, d, randomSeed=None):
-    vec = []
-    
     if randomSeed == None:
         randomSeed = long(time.clock()*100000000000000000)
     
     if randomSeed > -1:
         PDFTools.setSeed(randomSeed)
     
-    length = 0
-    for i in range(d):
-        tmp = PDFTools.sampleFloat(GaussianPDF())
-        vec = vec + [tmp]
-        length = length + tmp**2
-    
-    length = math.sqrt(length)
+    pdf = GaussianPDF()
+    vec = [PDFTools.sampleFloat(pdf) for i in range(d)]
+    length = math.sqrt(sum([x**2 for x in vec]))
+    vec = [x / length for x in vec]
     
-    f = []
-    for i in range(d):
-        vec[i] = vec[i] / length
-        f = f + [ConstantFunction(1, vec[i])]
+    f = [ConstantFunction(1, x) for x in vec]
     
     if randomSeed > -1:
         PDFTools.setSeed(long(time.clock()*1000000000000000))
@@ -206,8 +317,25 @@ def loadInputVectors(filename):
 
     return makeInputVectors(["vec_" + str(i) for i in range(len(vectors))], vectors)
 
+def shareEvalPoints(ef):
+    """With SHARE_EVAL_POINTS, makes the ensemble factory ef draw its eval points from the shared
+    pool (saved between runs with PERSIST_EVAL_POINTS). Returns ef."""
+    
+    if SHARE_EVAL_POINTS and not isinstance(ef.evalPointFactory, vectorgenerators.SharedEvalPointGenerator):
+        #the eval points only depend on the generator, the dimension and the number of points,
+        #so they can be generated once and shared by all the ensembles made with these factories
+        folder = None
+        if PERSIST_EVAL_POINTS:
+            folder = evalPointCacheFolder()
+        ef.evalPointFactory = vectorgenerators.SharedEvalPointGenerator(ef.evalPointFactory, folder=folder)
+    return ef
+
 #an NEF ensemble factory with more evaluation points than normal
 class NEFMorePoints(NEFEnsembleFactoryImpl):
+    def __init__(self):
+        NEFEnsembleFactoryImpl.__init__(self)
+        shareEvalPoints(self)
+    
     def getNumEvalPoints(self, d):
         #add shortcut so that it doesn't waste time evaluating a bunch of points when its in direct mode
         if SIMULATION_MODE == SimulationMode.DIRECT:
@@ -229,12 +357,84 @@ def defaultEnsembleFactory():
     ef.beQuiet()
     return(ef)
 
+#template populations used by makeFromTemplate, keyed by factory settings, N and d
+templates = {}
+
+def _pdfKey(pdf):
+    try:
+        return (pdf.getClass().getName(), pdf.getLow(), pdf.getHigh())
+    except AttributeError:
+        return id(pdf) #a distribution we don't know how to compare, so only reuse it with itself
+
+def _objectKey(obj):
+    if obj == None:
+        return None
+    if isinstance(obj, vectorgenerators.SharedEvalPointGenerator):
+        return obj.key
+    try:
+        #(a digest of its serialized form, so that any of its settings can tell it apart)
+        return vectorgenerators.generatorKey(obj)
+    except IOException:
+        return (obj.getClass().getName(), id(obj)) #an object we can't compare, so only reuse it with itself
+
+#the settings of an ensemble factory that determine the populations it makes: the neuron
+#parameters (and any other settings of the node factory, such as noise), and the encoder, eval
+#point and decoder factories with their parameters. (the radii aren't needed, since templates
+#are always made with ef.make(name, N, d), i.e. with unit radii.)
+def factoryKey(ef):
+    nf = ef.nodeFactory
+    return (ef.getClass().getName(), nf.getClass().getName(), nf.tauRC, nf.tauRef, 
+            _pdfKey(nf.maxRate), _pdfKey(nf.intercept), _objectKey(nf), _objectKey(ef.encoderFactory),
+            _objectKey(ef.evalPointFactory), _objectKey(getattr(ef, "approximatorFactory", None)),
+            str(SIMULATION_MODE))
+
+#makes a population with ef, or if REUSE_POPULATIONS is set, clones a template population
+#(made with ef the first time a population with these settings is requested). setup is an
+#optional function that adds things (e.g. decoded origins) to each new population, and
+#setupKey identifies what it adds (since those are then part of the template).
+def makeFromTemplate(ef, name, N, d, setup=None, setupKey=None):
+    if not REUSE_POPULATIONS:
+        pop = ef.make(name, N, d)
+        if setup != None:
+            setup(pop)
+        return pop
+    
+    key = (factoryKey(ef), N, d, setupKey)
+    template = templates.get(key)
+    if template == None:
+        template = ef.make(name, N, d)
+        if setup != None:
+            setup(template)
+        templates[key] = template
+    
+    pop = template.clone()
+    pop.setName(name)
+    return pop
+
+#discards the template populations (e.g. after changing the seed)
+def clearTemplates():
+    templates.clear()
+
+#sets the number of threads Nengo steps the nodes of a network with (default NUM_THREADS).
+#within a timestep each node only reads the outputs of the previous step, so the nodes are
+#independent work units and the results don't depend on the number of threads.
+def setThreads(numThreads=None):
+    if numThreads == None:
+        numThreads = NUM_THREADS
+    
+    if numThreads == 1:
+        NodeThreadPool.turnOffMultithreading()
+    elif numThreads > 1:
+        #turning multithreading on can reset the number of threads, so that is set afterwards
+        NodeThreadPool.turnOnMultithreading()
+        NodeThreadPool.setNumJavaThreads(numThreads)
+
 #returns all the probes containing name
 def findMatchingProbes(probes, name, subname=None):
     result = []
     for probe in probes:
         if name in probe.getTarget().getName() or ((probe.getEnsembleName() != None) and (probe.getEnsembleName().count(name) > 0)):
-            result = result + [probe]
+            result.append(probe)
     
     if subname == None:
         return result
@@ -248,14 +448,11 @@ def cconv(vec1, vec2):
     if vec2 == None:
         return(vec1)
     
-    d = len(vec1)
-    result = [0 for i in range(d)]
-    
-    for i in range(d):
-        for j in range(d):
-            result[i] = result[i] + vec1[j] * vec2[(i - j) % d]
-    
-    return(result)
+    return fft.cconv(vec1, vec2)
+
+#calculate circular convolution of each pair of vectors in vecs1 and vecs2
+def cconvBatch(vecs1, vecs2):
+    return fft.cconvBatch(vecs1, vecs2)
 
 #calculate vector addition of vec1 and vec2
 def vecsum(vec1, vec2):
@@ -264,15 +461,15 @@ def vecsum(vec1, vec2):
     if vec2 == None:
         return(vec1)
 
-    return [x+y for x,y in zip(vec1,vec2)]
+    return hrr.toList(hrr.add(vec1, vec2))
 
 #calculate length of vec
 def length(vec):
-    return math.sqrt(sum([x**2 for x in vec]))
+    return hrr.length(vec)
 
 #normalize vec
 def normalize(vec):
-    l = length(vec)
+    l = hrr.length(vec)
     if l == 0:
         return vec
     return [x/l for x in vec]
@@ -283,44 +480,33 @@ def similarity(vec1, vec2):
         System.err.println("vectors not the same length in RPMutils.similarity(), something is wrong")
         System.err.println(str(len(vec1)) + " " + str(len(vec2)))
 
-    return sum([x*y for x,y in zip(vec1,vec2)])
+    return hrr.dot(vec1, vec2)
 
 def ainv(vec):
-    newvec = []
-    for i,val in enumerate(vec):
-        newvec += [vec[-i % len(vec)]]
-    
-    return newvec
+    return hrr.toList(hrr.ainv(vec))
 
 #calculate mean value of vec
 def mean(vec):
-    if len(vec) == 0:
-        return 0.0
-    return float(sum(vec)) / len(vec)
+    return hrr.mean(vec)
 
 #calculate the words in vocab that vec1 and vec2 have in common
 def calcSame(vec1, vec2, vocab, threshold, weight1, weight2):
-    vec1 = [x*weight1 for x in vec1]
-    vec2 = [x*weight2 for x in vec2]
-    vec = vecsum(vec1,vec2)
+    vec = hrr.weightedSum(vec1, weight1, vec2, weight2)
     
-    ans = [0 for i in range(len(vec))]
+    ans = hrr.zeros(len(vec))
     for word in vocab:
-        if similarity(vec,word) > threshold:
-            ans = vecsum(ans,word)
+        if hrr.dot(vec,word) > threshold:
+            hrr.accumulate(ans, word)
 
-    return normalize(ans)
+    return hrr.toList(hrr.normalizeInPlace(ans))
 
 #calculate the words in vocab that vec1 and vec2 have distinct
 def calcDiff(vec1, vec2, vocab, threshold, weight1, weight2):
-    vec1 = [x*weight1 for x in vec1]
-    vec2 = [x*weight2 for x in vec2]
-    vec = [x-y for x,y in zip(vec1,vec2)]
+    vec = hrr.weightedSum(vec1, weight1, vec2, -weight2)
     
-    ans = [0 for i in range(len(vec))]
+    ans = hrr.zeros(len(vec))
     for word in vocab:
-        if similarity(vec,word) > threshold or similarity(vec,word) < -threshold:
-            ans = vecsum(ans,word)
+        if abs(hrr.dot(vec,word)) > threshold:
+            hrr.accumulate(ans, word)
 
-    return normalize(ans)
-    
\ No newline at end of file
+    return hrr.toList(hrr.normalizeInPlace(ans))
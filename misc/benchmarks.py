@@ -0,0 +1,118 @@
+"""Microbenchmarks for the parts of the model that are run many times during network construction.
+
+Run with Nengo's command line interpreter, e.g.
+
+    nengo-cl misc/benchmarks.py            (eval point generator scaling)
+    nengo-cl misc/benchmarks.py threads    (simulation speedup with NUM_THREADS)"""
+
+import os
+import sys
+import time
+
+from java.lang import System
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))
+
+from misc import RPMutils
+from misc import hrr
+from misc import vectorgenerators
+
+def timeCall(func, repeats=3):
+    """Returns the fastest of repeats runs of func(), in seconds."""
+
+    best = None
+    for i in range(repeats):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def scaling(name, gen, d, sizes):
+    """Times gen.genVectors(N, d) for each N in sizes, and prints the time per vector.
+
+    A linear time generator gives a roughly constant time per vector as N grows."""
+
+    System.out.println(name + " (d=" + str(d) + ")")
+    results = []
+    for N in sizes:
+        elapsed = timeCall(lambda: gen.genVectors(N, d))
+        results.append((N, elapsed))
+        System.out.println("  N=%-8d %8.4fs  %8.2fus per vector" % (N, elapsed, 1e6 * elapsed / N))
+    return results
+
+def evalPointScaling(d=30, sizes=None):
+    """Scaling of the eval point and encoder generators, up to the number of eval points
+    NEFMorePoints asks for (d*500)."""
+
+    if sizes == None:
+        sizes = [d*500/8, d*500/4, d*500/2, d*500]
+
+    direction = hrr.toList(hrr.normalize([1.0 for i in range(d)]))
+
+    scaling("DirectedEvalPointGenerator", vectorgenerators.DirectedEvalPointGenerator(direction), d, sizes)
+    scaling("RangedEvalPointGenerator", vectorgenerators.RangedEvalPointGenerator([[-1.0, -0.5], [0.5, 1.0]]), 1, sizes)
+    scaling("MultiplicationVectorGenerator", vectorgenerators.MultiplicationVectorGenerator(), 2, sizes)
+
+    cleanup = vectorgenerators.CleanupVectorGenerator()
+    cleanup.setVocabulary([direction])
+    scaling("CleanupVectorGenerator", cleanup, d, sizes)
+
+def threadScaling(d=30, threads=None, simtime=None, matrixfile=None):
+    """Runs SequenceSolver with each number of threads, and prints the speedup over one thread.
+    
+    Also checks that the answer scores are the same for every number of threads."""
+    
+    from misc import vocabulary
+    from misc import matrixhandler
+    from networks import sequencesolver
+    
+    if threads == None:
+        threads = [1, 2, 4, 8]
+    if simtime == None:
+        simtime = 5*RPMutils.STEP_SIZE
+    if matrixfile == None:
+        matrixfile = os.path.join(RPMutils.CURR_LOCATION, "sequencematrix_1.txt")
+    
+    RPMutils.RUN_WITH_CONTROLLER = False
+    vocab = vocabulary.genVocab(d, RPMutils.VOCAB_SIZE, 107)
+    mhandler = matrixhandler.MatrixHandler(matrixfile, vocab)
+    solver = sequencesolver.SequenceSolver(d*RPMutils.NEURONS_PER_DIMENSION, d, mhandler.encodeAll())
+    
+    System.out.println("SequenceSolver (d=" + str(d) + ", " + str(simtime) + "s simulated)")
+    base = None
+    basescores = None
+    results = []
+    for n in threads:
+        RPMutils.setThreads(n)
+        solver.reset(False)
+        solver.simulator.resetProbes()
+        
+        start = time.time()
+        solver.run(0.0, simtime)
+        elapsed = time.time() - start
+        
+        probe = RPMutils.findMatchingProbes(solver.simulator.getProbes(), "testSimilarity")[0]
+        values = probe.getData().getValues()
+        scores = list(values[len(values)-1])
+        
+        if base == None:
+            base = elapsed
+            basescores = scores
+        diff = max([abs(x - y) for x,y in zip(scores, basescores)])
+        
+        results.append((n, elapsed, base / elapsed))
+        System.out.println("  threads=%-3d %8.2fs  speedup %5.2f  max score difference %g" % (n, elapsed, base / elapsed, diff))
+    
+    RPMutils.setThreads()
+    return results
+
+if __name__ == "__main__":
+    RPMutils.CURR_LOCATION = os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "threads":
+        threadScaling()
+    else:
+        evalPointScaling()
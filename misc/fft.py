@@ -0,0 +1,152 @@
+"""Fast Fourier transforms and FFT-based circular convolution of HRR vectors."""
+
+import math
+import cmath
+
+#twiddle factor tables, keyed by (n, sign)
+_twiddles = {}
+
+#smallest prime factor of each transform size we have seen
+_factors = {}
+
+def _twiddle(n, sign):
+    """Returns the table of exp(sign*2*pi*i*j/n) for j in 0..n-1."""
+
+    key = (n, sign)
+    table = _twiddles.get(key)
+    if table == None:
+        table = [cmath.exp(complex(0, sign * 2 * math.pi * j / n)) for j in range(n)]
+        _twiddles[key] = table
+    return table
+
+def _factor(n):
+    """Returns the smallest prime factor of n."""
+
+    p = _factors.get(n)
+    if p == None:
+        p = n
+        if n % 2 == 0:
+            p = 2
+        else:
+            f = 3
+            while f * f <= n:
+                if n % f == 0:
+                    p = f
+                    break
+                f = f + 2
+        _factors[n] = p
+    return p
+
+def _transform(x, sign):
+    """Mixed-radix decimation in time transform of the complex sequence x.
+
+    Runs in O(n log n) when n factors into small primes (sizes with large prime
+    factors fall back to a direct DFT for that factor)."""
+
+    n = len(x)
+    if n == 1:
+        return [x[0]]
+
+    w = _twiddle(n, sign)
+    p = _factor(n)
+
+    if p == n:
+        #prime length, use the direct DFT
+        return [sum([x[j] * w[(j*k) % n] for j in range(n)]) for k in range(n)]
+
+    m = n // p
+    subs = [_transform(x[r::p], sign) for r in range(p)]
+
+    out = [0j] * n
+    if p == 2:
+        even = subs[0]
+        odd = subs[1]
+        for k in range(m):
+            t = w[k] * odd[k]
+            out[k] = even[k] + t
+            out[k+m] = even[k] - t
+    else:
+        for k in range(m):
+            for q in range(p):
+                idx = k + m*q
+                s = subs[0][k]
+                for r in range(1, p):
+                    s = s + w[(r*idx) % n] * subs[r][k]
+                out[idx] = s
+
+    return out
+
+def fft(vec):
+    """Discrete Fourier transform of vec (unnormalized)."""
+
+    return _transform([complex(x) for x in vec], -1)
+
+def ifft(vec):
+    """Inverse discrete Fourier transform of vec (scaled by 1/n)."""
+
+    n = len(vec)
+    return [x / n for x in _transform(list(vec), 1)]
+
+def _fftpair(vec1, vec2):
+    """Returns the DFTs of two real vectors, computed with a single complex transform."""
+
+    n = len(vec1)
+    Z = _transform([complex(x, y) for x,y in zip(vec1, vec2)], -1)
+
+    #separate the two spectra using the conjugate symmetry of real signals
+    F1 = [0j] * n
+    F2 = [0j] * n
+    for k in range(n):
+        zk = Z[k]
+        zc = Z[-k % n].conjugate()
+        F1[k] = (zk + zc) * 0.5
+        F2[k] = (zk - zc) * -0.5j
+
+    return F1, F2
+
+def cconv(vec1, vec2):
+    """Circular convolution of vec1 and vec2 (a None input is treated as the identity)."""
+
+    if vec1 == None:
+        return(vec2)
+    if vec2 == None:
+        return(vec1)
+
+    n = len(vec1)
+    F1, F2 = _fftpair(vec1, vec2)
+    result = _transform([x*y for x,y in zip(F1,F2)], 1)
+
+    return [x.real / n for x in result]
+
+def cconvBatch(vecs1, vecs2):
+    """Circular convolution of each pair (vecs1[i], vecs2[i]).
+
+    Both spectra of a pair come from one complex transform, and the products are
+    inverted two at a time (see ifftRealBatch)."""
+
+    if len(vecs1) != len(vecs2):
+        raise ValueError("cconvBatch needs the same number of vectors in each list")
+
+    products = []
+    for vec1, vec2 in zip(vecs1, vecs2):
+        F1, F2 = _fftpair(vec1, vec2)
+        products.append([x*y for x,y in zip(F1,F2)])
+
+    return ifftRealBatch(products)
+
+def ifftRealBatch(spectra):
+    """Inverse transforms of the given spectra of real signals (returning the real signals).
+
+    Since the results are real, two spectra share each complex inverse transform."""
+
+    result = [None for i in range(len(spectra))]
+    for i in range(0, len(spectra), 2):
+        n = len(spectra[i])
+        if i+1 < len(spectra):
+            packed = _transform([x + 1j*y for x,y in zip(spectra[i], spectra[i+1])], 1)
+            result[i] = [x.real / n for x in packed]
+            result[i+1] = [x.imag / n for x in packed]
+        else:
+            result[i] = [x.real / n for x in _transform(spectra[i], 1)]
+
+    return result
@@ -0,0 +1,118 @@
+"""Array-backed HRR vector algebra.
+
+Vectors are stored as array('d') so that sums and scalings can be accumulated in place
+rather than building a new list at every step. Any sequence of floats is accepted as
+input; use toList() when handing a vector to Nengo."""
+
+import math
+import operator
+from array import array
+
+from misc import fft
+
+def zeros(d):
+    """Returns a d-dimensional zero vector."""
+
+    return array('d', [0.0]) * d
+
+def asArray(vec):
+    """Returns vec as an array (vec itself if it already is one)."""
+
+    if isinstance(vec, array):
+        return vec
+    return array('d', vec)
+
+def toList(vec):
+    """Returns vec as a list of floats (the form Nengo expects)."""
+
+    if isinstance(vec, array):
+        return vec.tolist()
+    return list(vec)
+
+def dot(vec1, vec2):
+    """Dot product of vec1 and vec2."""
+
+    return sum(map(operator.mul, vec1, vec2))
+
+def length(vec):
+    """Euclidean length of vec."""
+
+    return math.sqrt(dot(vec, vec))
+
+def scale(vec, s):
+    """Returns vec*s."""
+
+    return array('d', [x*s for x in vec])
+
+def add(vec1, vec2):
+    """Returns vec1 + vec2."""
+
+    return array('d', map(operator.add, vec1, vec2))
+
+def weightedSum(vec1, weight1, vec2, weight2):
+    """Returns weight1*vec1 + weight2*vec2 without building the scaled vectors."""
+
+    return array('d', [x*weight1 + y*weight2 for x,y in zip(vec1, vec2)])
+
+def accumulate(acc, vec, weight=1.0):
+    """Adds weight*vec to acc in place, and returns acc."""
+
+    for i,x in enumerate(vec):
+        acc[i] += weight * x
+    return acc
+
+#vectors shorter than this are treated as zero when normalizing (e.g. a product with the null
+#vector computed by FFT, which is only zero up to rounding noise of around 1e-14)
+ZERO_LENGTH = 1e-8
+
+def normalize(vec):
+    """Returns vec scaled to unit length (a zero vector, or one within ZERO_LENGTH of zero,
+    is returned as exact zeros)."""
+
+    l = length(vec)
+    if l < ZERO_LENGTH:
+        return zeros(len(vec))
+    return scale(vec, 1.0 / l)
+
+def normalizeInPlace(vec):
+    """Scales vec to unit length in place (setting it to exact zeros if it is within
+    ZERO_LENGTH of zero), and returns it."""
+
+    l = length(vec)
+    if l < ZERO_LENGTH:
+        l = 0.0
+    else:
+        l = 1.0 / l
+    for i in range(len(vec)):
+        vec[i] *= l
+    return vec
+
+def ainv(vec):
+    """Approximate inverse of vec (under circular convolution)."""
+
+    d = len(vec)
+    return array('d', [vec[-i % d] for i in range(d)])
+
+def mean(vec):
+    """Mean value of the elements of vec."""
+
+    if len(vec) == 0:
+        return 0.0
+    return float(sum(vec)) / len(vec)
+
+def cconv(vec1, vec2):
+    """Circular convolution of vec1 and vec2 (a None input is treated as the identity)."""
+
+    if vec1 == None:
+        vec1, vec2 = vec2, vec1
+    if vec2 == None:
+        if vec1 == None:
+            return None
+        return array('d', vec1)
+
+    return array('d', fft.cconv(vec1, vec2))
+
+def similarities(vec, vecs):
+    """Returns the dot product of vec with each vector in vecs."""
+
+    return [dot(vec, v) for v in vecs]
@@ -1,37 +1,179 @@
 """Contains the information for one matrix, and can output it in the form the model needs."""
 
 import math
+import operator
+import os
+import struct
+import sys
+import jarray
 from java.lang import System
+from java.lang import String
+from java.io import BufferedOutputStream
+from java.io import DataOutputStream
+from java.io import FileOutputStream
+from java.io import RandomAccessFile
+from java.nio.channels import FileChannel
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))
 
 from misc import RPMutils
+from misc import fft
+from misc import hrr
 from misc import vocabulary
 
+#the number of cells in a matrix (8 matrix cells followed by 8 answers)
+MATRIX_CELLS = 16
+
+#identifies a compiled matrix corpus, and the version of its format
+CORPUS_MAGIC = 0x52504d43
+CORPUS_VERSION = 1
+
+def matrixLines(stream):
+    """Yields the lines of a matrix file, skipping any blank lines or lines that start with #."""
+    
+    for line in stream:
+        line = line.strip()
+        if line != "" and not line.startswith("#"):
+            yield line
+
+def readMatrices(stream, numcells=MATRIX_CELLS):
+    """Yields each matrix in the stream in turn (a file can contain any number of matrices, one after another).
+    
+    Each matrix is a list of cells, each cell a list of features, and each feature a list
+    of [attribute, value] pairs."""
+    
+    lines = matrixLines(stream)
+    while True:
+        matrix = []
+        for line in lines:
+            numfeatures = int(line)
+            cell = [None for j in range(numfeatures)]
+            for j in range(numfeatures):
+                cell[j] = [pair.split() for pair in lines.next().split(";")]
+            matrix.append(cell)
+            if len(matrix) == numcells:
+                break
+        
+        if len(matrix) == 0:
+            return
+        if len(matrix) < numcells:
+            System.err.println("Error, incomplete matrix at end of file (" + str(len(matrix)) + " cells)")
+            return
+        yield matrix
+
+def _normalizeSpectrum(X):
+    """Scales the spectrum X so that the corresponding signal has unit length."""
+    
+    #by Parseval's theorem, |x|^2 = sum(|X_k|^2) / n
+    l = math.sqrt(sum([x.real*x.real + x.imag*x.imag for x in X]) / len(X))
+    if l < hrr.ZERO_LENGTH:
+        return [0j] * len(X)
+    l = 1.0 / l
+    return [x*l for x in X]
+
+class BindingCache:
+    """A bounded least-recently-used cache of bound attribute-value vectors.
+    
+    hits and misses count the lookups, so we can check that encoding cost scales with the
+    number of unique pairs rather than the number of cells."""
+    
+    def __init__(self, size=4096):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        
+        #entries are kept in a circular doubly linked list of [prev, next, key, value] links,
+        #most recently used at the end
+        self.links = {}
+        self.root = [None, None, None, None]
+        self.root[0] = self.root
+        self.root[1] = self.root
+    
+    def get(self, key):
+        """Returns the value for key (or None if it isn't in the cache)."""
+        
+        link = self.links.get(key)
+        if link == None:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        
+        #move the link to the most recently used end
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+        last = self.root[0]
+        last[1] = link
+        self.root[0] = link
+        link[0] = last
+        link[1] = self.root
+        
+        return link[3]
+    
+    def put(self, key, value):
+        """Adds value to the cache (evicting the least recently used entry if the cache is full)."""
+        
+        if key in self.links:
+            self.links[key][3] = value
+            return
+        
+        if len(self.links) >= self.size:
+            oldest = self.root[1]
+            self.root[1] = oldest[1]
+            oldest[1][0] = self.root
+            del self.links[oldest[2]]
+        
+        last = self.root[0]
+        link = [last, self.root, key, value]
+        last[1] = link
+        self.root[0] = link
+        self.links[key] = link
+    
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        
+        self.links = {}
+        self.root[0] = self.root
+        self.root[1] = self.root
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self.links)
+
+#the binding cache used by default by every MatrixHandler
+bindingCache = BindingCache()
+
 class MatrixHandler:
 
-    def __init__(self, matrixfilename, vocab):
-        self.vocab = vocab
+    def __init__(self, matrixfilename, vocab, matrix=None, cache=None):
+        #the matrix can be read from file or given directly (e.g. from readMatrices)
+        
+        #a plain list is wrapped in the same Vocabulary every time, so the binding cache
+        #(which is keyed on the vocabulary) is shared between handlers
+        self.vocab = vocabulary.asVocabulary(vocab)
         
-        self.matrix = [None for i in range(16)]
-        self.numfeatures = [None for i in range(16)]
+        #the cache of bound attribute-value vectors (shared by all handlers by default)
+        if cache == None:
+            cache = bindingCache
+        self.cache = cache
         
         #read in the matrix information
-        matrixfile = open(matrixfilename)
-        for i in range(16):
-            self.numfeatures[i] = int(self.readMatrixLine(matrixfile))
-            self.matrix[i] = [None for j in range(self.numfeatures[i])]
-            for j in range(self.numfeatures[i]):
-                pairs = self.readMatrixLine(matrixfile).split(";")
-                self.matrix[i][j] = [pair.split() for pair in pairs]
-        matrixfile.close()
+        if matrix == None:
+            matrixfile = open(matrixfilename)
+            matrix = readMatrices(matrixfile).next()
+            matrixfile.close()
+        
+        self.matrix = matrix
+        self.numfeatures = [len(cell) for cell in matrix]
             
     def readMatrixLine(self, matrixfile):
         """Reads in the next line from the matrix file (skipping any blank lines or lines that start with #)."""
-        line = matrixfile.readline().strip()             
-        
-        while line == "" or line.startswith("#"):
-            line = matrixfile.readline().strip()
         
-        return line
+        for line in matrixLines(matrixfile):
+            return line
+        return ""
     
     def getAttributes(self, feature):
         """Returns the attributes present in the given feature."""
@@ -41,12 +183,38 @@ class MatrixHandler:
         
         return [pair[0] for pair in self.matrix[0][feature]]
     
+    def bindPair(self, attr, val):
+        """Returns the (normalized) vector for the given attribute-value pair.
+        
+        Note: the result is shared through the binding cache, so it must not be modified."""
+        
+        key = (self.vocab, self.vocab.version, attr, val)
+        vec = self.cache.get(key)
+        if vec == None:
+            vec = hrr.normalizeInPlace(hrr.cconv(self.getVocabVal(attr), self.getVocabVal(val)))
+            self.cache.put(key, vec)
+        return vec
+    
+    def bindFeature(self, feature):
+        """Returns the (normalized) AxB product of the attribute-value pairs in the given feature.
+        
+        Note: the result is shared through the binding cache, so it must not be modified."""
+        
+        key = (self.vocab, self.vocab.version, "AxB") + tuple([(attr,val) for attr,val in feature])
+        vec = self.cache.get(key)
+        if vec == None:
+            for attr,val in feature:
+                vec = hrr.cconv(vec, self.bindPair(attr, val))
+            vec = hrr.normalizeInPlace(hrr.asArray(vec)) #(copy if there is only one pair, since we're normalizing in place)
+            self.cache.put(key, vec)
+        return vec
+    
     def getVocabVal(self, word):
         """Returns the vector associated with the given word."""
         
-        for line in self.vocab:
-            if line[0] != None and line[0] == word:
-                return line[1]
+        vec = self.vocab.get(word)
+        if vec != None:
+            return vec
         System.err.println("Error, " + word + " not found in vocab")
         return None
     
@@ -76,47 +244,106 @@ class MatrixHandler:
     def encodeMatrix(self, matrix):
         """Converts the matrix into vector form."""
         
-        #check if there is more than one feature in the matrix
-        #this is relevant because if there is more than one feature then
-        #we will encode each feature as A + B + AxB, whereas if there is
-        #only one feature we will just use A + B
-        oneFeature = True
-        for cell in matrix:
-            if len(cell) > 1:
-                oneFeature = False
+        return self.encodeBatch([matrix])
+    
+    def encodeAll(self):
+        """Converts the matrix and the answers into vector form (the 16 cells given to SequenceSolver)."""
         
-        result = []
-        #for each cell in the matrix
-        for cell in matrix:
-            vec = None #the vector representation for this cell
+        return self.encodeBatch([self.getMatrix(), self.getAnswers()])
+    
+    def encodeBatch(self, matrices):
+        """Converts each of the given (sub)matrices into vector form, and returns all the cells in one list.
+        
+        All the encoding is done in the frequency domain: every word is resolved to its
+        (cached) spectrum up front, bindings are element-wise products, sums stay sums, and
+        lengths come from Parseval's theorem. Each cell then needs only one inverse FFT
+        (and two cells share each one). Empty cells are encoded as exact zeros (the null vector)."""
+        
+        d = self.vocab.dimensions()
+        
+        cells = []
+        empty = [] #the indices of the empty cells
+        for matrix in matrices:
+            #check if there is more than one feature in the matrix
+            #this is relevant because if there is more than one feature then
+            #we will encode each feature as A + B + AxB, whereas if there is
+            #only one feature we will just use A + B
+            oneFeature = True
+            for cell in matrix:
+                if len(cell) > 1:
+                    oneFeature = False
             
-            #for each feature in the cell
-            for feature in cell:
-                featurevec = None #the vector representation for this feature (the A + B part)
-                prodvec = None #the AxB part of the vector representation of this feature
+            #for each cell in the matrix
+            for cell in matrix:
+                vec = None #the spectrum of the vector representation for this cell
                 
-                #for each attr in the feature
-                for attr,val in feature:
-                    attribute = self.getVocabVal(attr)
-                    value = self.getVocabVal(val)
+                #for each feature in the cell
+                for feature in cell:
+                    featurevec = [0j] * d #the A + B part of this feature
+                    prodvec = None #the AxB part of this feature
                     
-                    pairword = RPMutils.normalize(RPMutils.cconv(attribute,value)) #vector for that attribute-value pair
+                    #for each attr in the feature
+                    for attr,val in feature:
+                        pairword = self.pairSpectrum(attr, val)
+                        featurevec = map(operator.add, featurevec, pairword)
+                        if not oneFeature:
+                            if prodvec == None:
+                                prodvec = pairword
+                            else:
+                                prodvec = map(operator.mul, prodvec, pairword)
                     
-                    featurevec = RPMutils.vecsum(featurevec, pairword)
-                    prodvec = RPMutils.cconv(prodvec,pairword)
-                
-                if oneFeature:
-                    if vec != None:
-                        System.err.println("oneFeature is true but more than one feature vector is being calculated!")
-                    vec = featurevec #ignore the AxB part and vec=featurevec because there is only one feature
-                else:
-                    #add this feature (including AxB part) to previous features in the cell 
-                    vec = RPMutils.vecsum(vec, RPMutils.normalize(RPMutils.vecsum(RPMutils.normalize(prodvec), RPMutils.normalize(featurevec))))
-            if vec==None:
-                vec = self.getVocabVal("null")
-            result = result + [RPMutils.normalize(vec)]
-        
-        return result
+                    if oneFeature:
+                        if vec != None:
+                            System.err.println("oneFeature is true but more than one feature vector is being calculated!")
+                        vec = featurevec #ignore the AxB part and vec=featurevec because there is only one feature
+                    else:
+                        #add this feature (including AxB part) to previous features in the cell 
+                        featurevec = _normalizeSpectrum(map(operator.add, _normalizeSpectrum(prodvec), _normalizeSpectrum(featurevec)))
+                        if vec == None:
+                            vec = featurevec
+                        else:
+                            vec = map(operator.add, vec, featurevec)
+                if vec == None:
+                    #an empty cell is the null vector, which is zero, so it is left out of the
+                    #inverse FFT rather than normalizing the rounding noise of a zero spectrum
+                    empty.append(len(cells))
+                    vec = [0j] * d
+                cells.append(vec)
+        
+        encoded = [hrr.toList(hrr.normalize(vec)) for vec in fft.ifftRealBatch(cells)]
+        for i in empty:
+            encoded[i] = [0.0] * d
+        return encoded
+    
+    def spectrum(self, word):
+        """Returns the Fourier transform of the vector for the given word (shared through the binding cache)."""
+        
+        key = (self.vocab, self.vocab.version, "fft", word)
+        X = self.cache.get(key)
+        if X == None:
+            vec = self.getVocabVal(word)
+            if vec != None:
+                X = fft.fft(vec)
+                self.cache.put(key, X)
+        return X
+    
+    def pairSpectrum(self, attr, val):
+        """Returns the Fourier transform of bindPair(attr, val) (shared through the binding cache)."""
+        
+        key = (self.vocab, self.vocab.version, "pairfft", attr, val)
+        X = self.cache.get(key)
+        if X == None:
+            A = self.spectrum(attr)
+            V = self.spectrum(val)
+            if A == None:
+                X = V
+            elif V == None:
+                X = A
+            else:
+                X = map(operator.mul, A, V)
+            X = _normalizeSpectrum(X)
+            self.cache.put(key, X)
+        return X
     
     def getMatrixVocab(self): 
         """Returns all the vocabulary (in vector form) used in this matrix."""
@@ -129,14 +356,14 @@ class MatrixHandler:
             for feature in cell:
                 fv = "" #the AxB tag
                 for attr,val in feature:   
-                    v = v + [attr + " " + val] #add the word for this attr-val pair to the list
+                    v.append(attr + " " + val) #add the word for this attr-val pair to the list
                     fv = fv + attr + " " + val + ";" #add this attr-val pair to the AxB tag
                 
                 if len(feature) > 1: 
                     #if more than one attribute in feature, add the tag to the word list (if there is
                     #only one attribute in feature then the tag is the same as the attr-val word we
                     #already added, so unnecessary)
-                    v = v + [fv]
+                    v.append(fv)
         
         #remove duplicates
         v.sort()
@@ -147,23 +374,192 @@ class MatrixHandler:
         #turn vocab into vectors
         vocab = []
         for word in v:
-            vec = None
-            prod = None
-            for pair in word.split(";"):
-                if pair:
-                    attr,val = pair.split(" ")
-                    
-                    #the vector for this attr-val pair
-                    pairword = RPMutils.normalize(RPMutils.cconv(self.getVocabVal(attr), self.getVocabVal(val)))
-                     
-                    vec = RPMutils.vecsum(vec, pairword)  #the non-tag part (vec should always be None, so vec=pairword)
-                    prod = RPMutils.cconv(prod, pairword) #the tag part
+            pairs = [pair.split(" ") for pair in word.split(";") if pair]
+            
             if ";" in word:
-                vec = prod #then use the tag part
-            vocab = vocab + [RPMutils.normalize(vec)]
+                vec = self.bindFeature(pairs) #the tag part
+            else:
+                vec = self.bindPair(pairs[0][0], pairs[0][1]) #the vector for this attr-val pair
+            vocab.append(hrr.toList(hrr.normalize(vec)))
         
         return vocab
     
     def printMatrix(self, matrix):
         for cell in matrix:
-            print cell
\ No newline at end of file
+            print cell
+
+def compileMatrices(matrixfiles, vocab, filename):
+    """Parses and encodes all the matrices in the given files, and writes them to a compiled corpus.
+    
+    The corpus holds each matrix's encoded cells (the same vectors as encodeAll) along with
+    the vocabulary ids of its attribute-value pairs, so that it can be loaded
+    with MatrixCorpus without parsing or encoding anything.
+    
+    Layout (big-endian): a header (magic, version, d, cells per matrix, the vocabulary words),
+    then one record per matrix (cells*d doubles, then for each cell the number of features
+    and for each feature the number of pairs and the attribute/value ids), then an index of
+    record offsets, and finally the index offset and the number of matrices.
+    
+    Returns the number of matrices written (or None if the file couldn't be written)."""
+    
+    vocab = vocabulary.asVocabulary(vocab)
+    d = vocab.dimensions()
+    offsets = []
+    
+    def write(tmpname):
+        output = DataOutputStream(BufferedOutputStream(FileOutputStream(tmpname)))
+        try:
+            output.writeInt(CORPUS_MAGIC)
+            output.writeInt(CORPUS_VERSION)
+            output.writeInt(d)
+            output.writeInt(MATRIX_CELLS)
+            output.writeInt(len(vocab))
+            for name in vocab.names:
+                output.writeUTF(name)
+            
+            #we keep track of the position ourselves since DataOutputStream.size() is only an int
+            position = long(output.size())
+            
+            for matrixfile in matrixfiles:
+                input = open(matrixfile)
+                for matrix in readMatrices(input):
+                    handler = MatrixHandler(matrixfile, vocab, matrix)
+                    encoded = handler.encodeAll()
+                    
+                    offsets.append(position)
+                    for vec in encoded:
+                        for x in vec:
+                            output.writeDouble(x)
+                    position = position + 8*len(encoded)*d
+                    
+                    for cell in matrix:
+                        output.writeInt(len(cell))
+                        position = position + 4
+                        for feature in cell:
+                            output.writeInt(len(feature))
+                            for attr,val in feature:
+                                for word in [attr, val]:
+                                    id = vocab.index(word)
+                                    if id == None:
+                                        System.err.println("Error, " + word + " not found in vocab")
+                                        id = -1
+                                    output.writeInt(id)
+                            position = position + 4 + 8*len(feature)
+                input.close()
+            
+            for offset in offsets:
+                output.writeLong(offset)
+            output.writeLong(position)
+            output.writeInt(len(offsets))
+        finally:
+            output.close()
+    
+    #write to a temporary file and rename it, so that an interrupted compile doesn't leave a
+    #truncated corpus behind
+    if not RPMutils.writeAtomically(filename, write):
+        return None
+    return len(offsets)
+
+def isCorpus(filename):
+    """Returns True if filename is a compiled matrix corpus (rather than a matrix file or manifest)."""
+    
+    if not os.path.isfile(filename):
+        return False
+    
+    input = open(filename, "rb")
+    magic = input.read(4)
+    input.close()
+    return len(magic) == 4 and struct.unpack(">i", magic)[0] == CORPUS_MAGIC
+
+class MatrixCorpus:
+    """A memory-mapped compiled matrix corpus (see compileMatrices)."""
+    
+    def __init__(self, filename):
+        input = RandomAccessFile(filename, "r")
+        channel = input.getChannel()
+        self.buffer = channel.map(FileChannel.MapMode.READ_ONLY, 0, channel.size())
+        input.close() #the mapping stays valid after the file is closed
+        
+        buffer = self.buffer
+        if buffer.getInt(0) != CORPUS_MAGIC or buffer.getInt(4) != CORPUS_VERSION:
+            System.err.println("Error, " + filename + " is not a version " + str(CORPUS_VERSION) + " matrix corpus")
+        
+        self.d = buffer.getInt(8)
+        self.numcells = buffer.getInt(12)
+        
+        #read the vocabulary words (written with writeUTF, i.e. a 2 byte length then the characters)
+        self.names = []
+        position = 20
+        for i in range(buffer.getInt(16)):
+            length = buffer.getShort(position) & 0xffff
+            chars = jarray.zeros(length, "b")
+            view = buffer.duplicate()
+            view.position(position + 2)
+            view.get(chars)
+            self.names.append(str(String(chars, "UTF-8")))
+            position = position + 2 + length
+        
+        size = buffer.capacity()
+        self.count = buffer.getInt(size - 4)
+        indexoffset = buffer.getLong(size - 12)
+        self.offsets = [buffer.getLong(indexoffset + 8*i) for i in range(self.count)]
+    
+    def __len__(self):
+        return self.count
+    
+    def getEncoded(self, i):
+        """Returns the encoded cells of the ith matrix (the matrix followed by the answers)."""
+        
+        values = jarray.zeros(self.numcells * self.d, "d")
+        view = self.buffer.duplicate()
+        view.position(self.offsets[i])
+        view.asDoubleBuffer().get(values)
+        
+        values = list(values)
+        d = self.d
+        return [values[j*d:(j+1)*d] for j in range(self.numcells)]
+    
+    def getMatrix(self, i):
+        """Returns the ith matrix in the same form as readMatrices."""
+        
+        buffer = self.buffer
+        position = self.offsets[i] + 8*self.numcells*self.d
+        
+        matrix = []
+        for j in range(self.numcells):
+            cell = []
+            for k in range(buffer.getInt(position)):
+                numpairs = buffer.getInt(position + 4)
+                position = position + 4
+                ids = [buffer.getInt(position + 4 + 4*x) for x in range(2*numpairs)]
+                cell.append([[self.names[ids[2*x]], self.names[ids[2*x+1]]] for x in range(numpairs)])
+                position = position + 8*numpairs
+            matrix.append(cell)
+            position = position + 4
+        
+        return matrix
+
+if __name__ == "__main__":
+    #check that an empty cell encodes to the null vector (all zeros), and that the other cells
+    #still have unit length; run with Nengo's command line interpreter,
+    #    nengo-cl misc/matrixhandler.py
+    RPMutils.CURR_LOCATION = os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))
+    
+    vocab = vocabulary.genVocab(RPMutils.VECTOR_DIMENSION, RPMutils.VOCAB_SIZE, 107)
+    input = open(os.path.join(RPMutils.CURR_LOCATION, "sequencematrix_1.txt"))
+    matrix = readMatrices(input).next()
+    input.close()
+    
+    handler = MatrixHandler(None, vocab, [[]] + matrix[1:])
+    encoded = handler.encodeAll()
+    failed = False
+    if max([abs(x) for x in encoded[0]]) != 0.0:
+        System.err.println("Error, the empty cell is not encoded as zeros (length " + str(hrr.length(encoded[0])) + ")")
+        failed = True
+    for i in range(1, len(encoded)):
+        if abs(hrr.length(encoded[i]) - 1.0) > 1e-6:
+            System.err.println("Error, cell " + str(i) + " has length " + str(hrr.length(encoded[i])))
+            failed = True
+    if failed:
+        sys.exit(1)
+    System.out.println("Encoding checks passed")
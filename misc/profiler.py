@@ -0,0 +1,233 @@
+"""Build-time and run-time profiling of the model's networks.
+
+instrumentBuilds() wraps the constructors of the networks in networks/ so that building
+records the wall time and bytes allocated for each sub-network (nested, so that e.g. the
+Eprods built inside a Cconv are recorded under it). profileRun() steps a built network by
+hand, recording the time spent stepping each node. The results are collected in profile,
+which can be written as a tab-separated table or as folded stacks for flame graph tools
+(e.g. flamegraph.pl). For example
+
+    from misc import profiler
+    profiler.instrumentBuilds()
+    solver = sequencesolver.SequenceSolver(N, d, matrix)
+    profiler.profileRun(solver, 0.0, 1.0)
+    profiler.profile.write("profile.txt")
+    profiler.profile.writeFolded("profile.folded")
+
+or run with Nengo's command line interpreter to profile SequenceSolver on sequencematrix_1.txt
+
+    nengo-cl misc/profiler.py [dimensions] [simulation time]"""
+
+import os
+import sys
+
+from java.lang import System
+from java.lang import Runtime
+from java.lang import Thread
+from java.lang.management import ManagementFactory
+
+from ca.nengo.model.impl import NetworkImpl
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))
+
+from misc import RPMutils
+
+#the network constructors that instrumentBuilds wraps (module, class, method)
+BUILD_METHODS = [("networks.sequencesolver", "SequenceSolver", "__init__"),
+                 ("networks.transform", "Transform", "__init__"),
+                 ("networks.cconv", "Cconv", "__init__"),
+                 ("networks.eprod", "Eprod", "__init__"),
+                 ("networks.average", "Average", "__init__"),
+                 ("networks.integrator", "Integrator", "__init__"),
+                 ("networks.similarity", "Similarity", "__init__"),
+                 ("networks.networkensemble", "NetworkEnsemble", "make")]
+
+def seconds():
+    return System.nanoTime() * 1e-9
+
+try:
+    #HotSpot can count the bytes allocated by each thread
+    from com.sun.management import ThreadMXBean as _AllocationBean
+    _threads = ManagementFactory.getThreadMXBean()
+    if not _AllocationBean.isThreadAllocatedMemorySupported(_threads):
+        raise ImportError("thread allocation counting not supported")
+
+    def allocatedBytes():
+        """Returns the number of bytes allocated by this thread so far."""
+
+        return _AllocationBean.getThreadAllocatedBytes(_threads, Thread.currentThread().getId())
+except (ImportError, AttributeError):
+    def allocatedBytes():
+        """Returns the used heap (an approximation of the bytes allocated so far, which drops
+        whenever garbage is collected)."""
+
+        runtime = Runtime.getRuntime()
+        return runtime.totalMemory() - runtime.freeMemory()
+
+class Profile:
+    """Calls, total time and bytes allocated for each (kind, path), where kind is "build" or
+    "step" and path is the tuple of names from the top level network down."""
+
+    def __init__(self):
+        self.records = {}
+
+    def add(self, kind, path, time, bytes=None):
+        record = self.records.get((kind, path))
+        if record == None:
+            record = [0, 0.0, None]
+            self.records[(kind, path)] = record
+
+        record[0] = record[0] + 1
+        record[1] = record[1] + time
+        if bytes != None:
+            record[2] = (record[2] or 0) + bytes
+
+    def clear(self):
+        self.records = {}
+
+    def selfTimes(self):
+        """Returns the time spent in each (kind, path) excluding the time spent in its children."""
+
+        times = dict([(key, record[1]) for key,record in self.records.items()])
+        for (kind, path),record in self.records.items():
+            parent = (kind, path[:-1])
+            if len(path) > 1 and parent in times:
+                times[parent] = times[parent] - record[1]
+        return times
+
+    def write(self, filename):
+        """Writes the profile as a tab-separated table (sorted by kind and path)."""
+
+        selftimes = self.selfTimes()
+        keys = self.records.keys()
+        keys.sort()
+
+        output = open(filename, "w")
+        output.write("\t".join(["kind", "path", "calls", "seconds", "self_seconds", "allocated_bytes"]) + "\n")
+        for key in keys:
+            kind, path = key
+            calls, time, bytes = self.records[key]
+            if bytes == None:
+                bytes = ""
+            output.write("\t".join([kind, "/".join(path), str(calls), "%.6f" % time, "%.6f" % selftimes[key], str(bytes)]) + "\n")
+        output.close()
+
+    def writeFolded(self, filename):
+        """Writes the self time (in microseconds) of each path as folded stacks, one
+        "kind;name;name;... count" line per path, for flame graph tools."""
+
+        selftimes = self.selfTimes()
+        keys = self.records.keys()
+        keys.sort()
+
+        output = open(filename, "w")
+        for key in keys:
+            kind, path = key
+            count = int(round(max(selftimes[key], 0.0) * 1e6))
+            if count > 0:
+                output.write(";".join([kind] + list(path)) + " " + str(count) + "\n")
+        output.close()
+
+#the profile that instrumentBuilds and profileRun record into
+profile = Profile()
+
+#names of the networks currently being built (outermost first)
+_stack = []
+
+#the original methods replaced by instrumentBuilds
+_originals = {}
+
+def _timed(method, label):
+    def timed(self, *args, **kwargs):
+        name = label
+        if len(args) > 0 and isinstance(args[0], str):
+            name = label + ":" + args[0]
+
+        _stack.append(name)
+        path = tuple(_stack)
+        start = seconds()
+        startbytes = allocatedBytes()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            profile.add("build", path, seconds() - start, allocatedBytes() - startbytes)
+            _stack.pop()
+    return timed
+
+def instrumentBuilds():
+    """Wraps the network constructors in BUILD_METHODS so that building them is profiled."""
+
+    for modulename,classname,methodname in BUILD_METHODS:
+        cls = getattr(__import__(modulename, globals(), locals(), [classname]), classname)
+        if (cls, methodname) not in _originals:
+            method = getattr(cls, methodname)
+            _originals[(cls, methodname)] = method
+            setattr(cls, methodname, _timed(method, classname))
+
+def removeInstrumentation():
+    """Restores the methods wrapped by instrumentBuilds."""
+
+    for (cls, methodname),method in _originals.items():
+        setattr(cls, methodname, method)
+    _originals.clear()
+
+def _step(network, path, start, end):
+    stepstart = seconds()
+
+    #as in Nengo's simulator, each termination gets the outputs from the end of the last step...
+    for projection in network.getProjections():
+        projection.getTermination().setValues(projection.getOrigin().getValues())
+
+    #...and then every node is run for this step
+    for node in network.getNodes():
+        nodepath = path + (node.getName(),)
+        if isinstance(node, NetworkImpl):
+            _step(node, nodepath, start, end)
+        else:
+            nodestart = seconds()
+            node.run(start, end)
+            profile.add("step", nodepath, seconds() - nodestart)
+
+    profile.add("step", path, seconds() - stepstart)
+
+def profileRun(network, start, end, dt=0.001):
+    """Runs network from start to end, recording the time spent stepping each node.
+
+    The network is stepped here rather than by its simulator (following the same order of
+    updates), so its probes are not updated."""
+
+    path = (network.getName(),)
+    steps = int(round((end - start) / dt))
+    for i in range(steps):
+        _step(network, path, start + i*dt, start + (i+1)*dt)
+
+if __name__ == "__main__":
+    from misc import vocabulary
+    from misc import matrixhandler
+
+    d = RPMutils.VECTOR_DIMENSION
+    simtime = 5*RPMutils.STEP_SIZE
+    if len(sys.argv) > 1:
+        d = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        simtime = float(sys.argv[2])
+
+    RPMutils.CURR_LOCATION = os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0])))
+    RPMutils.RUN_WITH_CONTROLLER = False
+
+    vocab = vocabulary.genVocab(d, RPMutils.VOCAB_SIZE, 107)
+    mhandler = matrixhandler.MatrixHandler(os.path.join(RPMutils.CURR_LOCATION, "sequencematrix_1.txt"), vocab)
+    matrix = mhandler.encodeAll()
+
+    instrumentBuilds()
+    from networks import sequencesolver
+    solver = sequencesolver.SequenceSolver(d*RPMutils.NEURONS_PER_DIMENSION, d, matrix)
+    profileRun(solver, 0.0, simtime)
+
+    folder = os.path.join(RPMutils.CURR_LOCATION, "data", RPMutils.FOLDER_NAME)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    profile.write(os.path.join(folder, "profile_" + str(d) + ".txt"))
+    profile.writeFolded(os.path.join(folder, "profile_" + str(d) + ".folded"))
+    System.out.println("Wrote profile to " + folder)
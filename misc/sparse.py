@@ -0,0 +1,91 @@
+"""Structured weight matrices (scaled identity, permutation and one-hot selector matrices).
+
+These stand in for the dense matrices (lists of rows) the network builders pass around. They
+can be indexed by row and have a length like a list of rows, but each row is stored as just
+one column index and one value, so they take O(d) memory and apply to a vector in O(d).
+
+Nengo only takes dense transforms, so use dense() (or the rows) when handing one to a
+termination. The termination then stores and applies the full matrix, so for the neural
+populations this only saves work while the networks are being built; the O(d) products are
+only used where the model applies the weights itself (the direct mode Eprod node)."""
+
+from misc import hrr
+
+class Selector:
+    """A matrix whose ith row has the single nonzero entry scales[i] in column indices[i]."""
+
+    def __init__(self, indices, columns, scales=1.0):
+        self.indices = list(indices)
+        self.columns = columns
+        if isinstance(scales, (int, long, float)):
+            self.scales = [float(scales) for i in self.indices]
+        else:
+            self.scales = [float(x) for x in scales]
+
+    def row(self, i):
+        """Returns the ith row as a dense list."""
+
+        row = [0.0 for j in range(self.columns)]
+        row[self.indices[i]] = self.scales[i]
+        return row
+
+    def dense(self):
+        """Returns the matrix as a list of dense rows."""
+
+        return [self.row(i) for i in range(len(self.indices))]
+
+    def apply(self, vec):
+        """Returns the product of the matrix and vec."""
+
+        return [s * vec[j] for j,s in zip(self.indices, self.scales)]
+
+    def scale(self, s):
+        """Returns the matrix times s."""
+
+        return Selector(self.indices, self.columns, [x * s for x in self.scales])
+
+    def append(self, other):
+        """Returns the matrix with the rows of other added below it."""
+
+        return Selector(self.indices + other.indices, self.columns, self.scales + other.scales)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.row(i)
+
+    def __iter__(self):
+        for i in range(len(self.indices)):
+            yield self.row(i)
+
+def identity(d, val=1.0):
+    """val times the d x d identity (the structured version of RPMutils.eye)."""
+
+    return Selector(range(d), d, val)
+
+def permutation(perm, scale=1.0):
+    """The matrix whose ith row picks out element perm[i] of its input (times scale)."""
+
+    return Selector(perm, len(perm), scale)
+
+def dense(matrix):
+    """Returns matrix as a list of dense rows (matrix itself if it already is one)."""
+
+    if isinstance(matrix, Selector):
+        return matrix.dense()
+    return matrix
+
+def rowSums(matrix):
+    """Returns the sum of each row of matrix (structured or dense)."""
+
+    if isinstance(matrix, Selector):
+        return list(matrix.scales)
+    return [sum(row) for row in matrix]
+
+def apply(matrix, vec):
+    """Returns the product of matrix (structured or dense) and vec."""
+
+    if isinstance(matrix, Selector):
+        return matrix.apply(vec)
+    return [hrr.dot(row, vec) for row in matrix]
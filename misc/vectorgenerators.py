@@ -1,14 +1,155 @@
 """Functions to generate different sets of vectors."""
 
 import math
+import operator
+import os
+import jarray
 
 from java.io import Serializable
+from java.io import BufferedOutputStream
+from java.io import ByteArrayOutputStream
+from java.io import DataOutputStream
+from java.io import FileOutputStream
+from java.io import IOException
+from java.io import ObjectOutputStream
+from java.io import RandomAccessFile
+from java.lang import Float
+from java.lang import System
+from java.lang.reflect import Array
+from java.nio.channels import FileChannel
+from java.security import MessageDigest
 
 from ca.nengo.util import VectorGenerator
 from ca.nengo.math import PDFTools
 from ca.nengo.math.impl import GaussianPDF
 from ca.nengo.math.impl import IndicatorPDF
 
+def floatMatrix(N, d):
+    """Returns a preallocated N x d float[][] (which Nengo can take without converting it)."""
+    
+    return Array.newInstance(Float.TYPE, jarray.array([N, d], 'i'))
+
+#identifies (and versions) the eval point files written by EvalPointPool
+EVAL_POINTS_MAGIC = 0x52504d45
+EVAL_POINTS_VERSION = 1
+
+class EvalPointPool:
+    """A cache of generated eval point sets, keyed by generator, count and dimension.
+    
+    Ensembles with the same dimension and eval point distribution are given the same set
+    of points, so the sets must be treated as read-only. If a folder is given the sets are
+    also saved there, and loaded instead of generated in later runs."""
+    
+    def __init__(self):
+        self.points = {}
+    
+    def get(self, key, N, d, generator, folder=None):
+        """Returns N d-dimensional eval points from generator (or the cache)."""
+        
+        points = self.points.get((key, N, d))
+        if points != None:
+            return points
+        
+        filename = None
+        if folder != None:
+            filename = os.path.join(folder, "evalpoints_" + key + "_" + str(N) + "x" + str(d) + ".bin")
+            points = self.load(filename, N, d)
+        
+        if points == None:
+            points = generator.genVectors(N, d)
+            if filename != None:
+                self.save(points, filename, d)
+        
+        self.points[(key, N, d)] = points
+        return points
+    
+    def clear(self):
+        self.points = {}
+    
+    def load(self, filename, N, d):
+        """Loads a set of eval points saved with save (returns None if there is no valid file)."""
+        
+        if not os.path.exists(filename):
+            return None
+        
+        input = RandomAccessFile(filename, "r")
+        channel = input.getChannel()
+        buffer = channel.map(FileChannel.MapMode.READ_ONLY, 0, channel.size())
+        input.close()
+        
+        if (buffer.capacity() != 16 + 4*N*d or buffer.getInt(0) != EVAL_POINTS_MAGIC or 
+            buffer.getInt(4) != EVAL_POINTS_VERSION or buffer.getInt(8) != N or buffer.getInt(12) != d):
+            return None
+        
+        buffer.position(16)
+        floats = buffer.asFloatBuffer()
+        points = floatMatrix(N, d)
+        for vec in points:
+            floats.get(vec)
+        return points
+    
+    def save(self, points, filename, d):
+        """Saves a set of eval points (as big-endian floats, after a header with the size)."""
+        
+        from misc import RPMutils #imported here, since RPMutils imports this module
+        
+        def write(tmpname):
+            output = DataOutputStream(BufferedOutputStream(FileOutputStream(tmpname)))
+            try:
+                output.writeInt(EVAL_POINTS_MAGIC)
+                output.writeInt(EVAL_POINTS_VERSION)
+                output.writeInt(len(points))
+                output.writeInt(d)
+                for vec in points:
+                    for x in vec:
+                        output.writeFloat(x)
+            finally:
+                output.close()
+        
+        RPMutils.writeAtomically(filename, write)
+
+#the pool shared by all SharedEvalPointGenerators
+evalPointPool = EvalPointPool()
+
+def generatorKey(generator):
+    """Returns a key identifying generator and its parameters (its class name and a digest of
+    its serialized form), so generators with different settings get different keys."""
+    
+    bytes = ByteArrayOutputStream()
+    output = ObjectOutputStream(bytes)
+    output.writeObject(generator)
+    output.close()
+    
+    digest = MessageDigest.getInstance("MD5").digest(bytes.toByteArray())
+    return generator.getClass().getSimpleName() + "_" + "".join(["%02x" % (b & 0xff) for b in digest])
+
+class SharedEvalPointGenerator(VectorGenerator, Serializable):
+    """Returns eval points from evalPointPool, generating them with the given generator
+    the first time each (N, d) is requested.
+    
+    The points are shared by every generator with the same key, so the key must identify the
+    generator's parameters as well as its type (by default it is generatorKey(generator))."""
+    
+    serialVersionUID = 1
+    
+    def __init__(self, generator, key=None, folder=None):
+        self.generator = generator
+        self.key = key
+        self.folder = folder
+        if key == None:
+            try:
+                self.key = generatorKey(generator)
+            except IOException, e:
+                #we can't tell this generator's settings apart from others of its type, so
+                #only share its points with itself (and don't save them, since the key
+                #won't match in later runs)
+                System.err.println("Warning, could not identify eval point generator " + str(generator) + ": " + str(e))
+                self.key = generator.getClass().getSimpleName() + "_" + str(id(generator))
+                self.folder = None
+    
+    def genVectors(self, N, d):
+        return evalPointPool.get(self.key, N, d, self.generator, self.folder)
+
 class CleanupVectorGenerator(VectorGenerator, Serializable):
     """Returns the vectors contained in a vocabulary, one at a time."""
     
@@ -25,23 +166,23 @@ class CleanupVectorGenerator(VectorGenerator, Serializable):
         if self.index >= len(self.vocabulary):
             return([None])
         
+        word = self.vocabulary[self.index]
+        
         max = 0
-        for x in self.vocabulary[self.index]:
+        for x in word:
             if abs(x) > max:
                 max = abs(x)
-                
         
-        vecs = []
+        #draw all the noise at once (row-major, so the samples come out in the same
+        #order as generating the vectors one element at a time)
+        pdf = GaussianPDF(0.0, self.variance)
+        noise = [PDFTools.sampleFloat(pdf) * max for i in xrange(N*d)]
+        
+        vecs = [None] * N
         for i in range(N):
-            vec = [0 for x in range(d)]
-            length = 0
-            for j in range(d):
-                vec[j] = self.vocabulary[self.index][j] + PDFTools.sampleFloat(GaussianPDF(0.0, self.variance)) * max
-                length = length + vec[j]**2
-            length = math.sqrt(length)
-            for j in range(d):
-                vec[j] = vec[j] / length
-            vecs = vecs + [vec]
+            vec = map(operator.add, word, noise[i*d:(i+1)*d])
+            length = math.sqrt(sum([x**2 for x in vec]))
+            vecs[i] = [x / length for x in vec]
         
         return(vecs)
     
@@ -91,15 +232,16 @@ class DirectedEvalPointGenerator(VectorGenerator, Serializable):
         if d != len(self.dir):
             print "Error, direction dimension not equal to requested dimension in DirectedEvalPointGenerator"
             
-        vectors = []
+        direction = [float(x) for x in self.dir]
+        pdf = IndicatorPDF(0.0, 1.0)
+        
+        vectors = floatMatrix(N, d)
         for i in range(N):
-            scale = PDFTools.sampleFloat(IndicatorPDF(0.0, 1.0))
-            vec = [0.0 for i in range(d)]
+            scale = PDFTools.sampleFloat(pdf)
+            vec = vectors[i]
             
             for j in range(d):
-                vec[j] = float(self.dir[j]) * scale
-            vectors = vectors + [vec]
-            
+                vec[j] = direction[j] * scale
         
         return(vectors)
     
@@ -126,17 +268,20 @@ class RangedEvalPointGenerator(VectorGenerator, Serializable):
 #                val = PDFTools.sampleFloat(IndicatorPDF(self.low1, self.high2))
 #            vecs = vecs + [[val]]
         Nperrange = int(float(N)/self.numranges)
-        vecs = []
+        vecs = floatMatrix(N, 1)
+        k = 0
         for i in range(self.numranges):
             low = self.ranges[i][0]
             high = self.ranges[i][1]
+            pdf = IndicatorPDF(low, high)
             for j in range(Nperrange):
-                val = PDFTools.sampleFloat(IndicatorPDF(low, high))
-                vecs = vecs + [[val]]
+                vecs[k][0] = PDFTools.sampleFloat(pdf)
+                k = k + 1
         
+        #the leftover points come from the last range
         for j in range(N-(Nperrange*self.numranges)):
-            val = PDFTools.sampleFloat(IndicatorPDF(low, high))
-            vecs = vecs + [[val]]
+            vecs[k][0] = PDFTools.sampleFloat(pdf)
+            k = k + 1
         
         return vecs
 
@@ -150,10 +295,11 @@ class MultiplicationVectorGenerator(VectorGenerator, Serializable):
             print "Error, d !=2 when generating custom EUVs"
             
         angle = math.pi/4
-        vectors = []
+        vectors = floatMatrix(N, 2)
         
         for i in range(N):
-            vectors = vectors + [[math.cos(angle), math.sin(angle)]]
+            vectors[i][0] = math.cos(angle)
+            vectors[i][1] = math.sin(angle)
             angle = (angle + math.pi/2) % (2 * math.pi)
         
         return(vectors)
@@ -2,6 +2,8 @@
 
 import time
 import math
+import os
+import struct
 
 from java.lang import System
 from java.io import File
@@ -10,18 +12,208 @@ from ca.nengo.math import PDFTools
 from ca.nengo.math.impl import GaussianPDF
 
 from misc import RPMutils
+from misc import hrr
+
+#version of the binary vocabulary cache format and of the vector generation (bump to invalidate
+#existing caches). 2: vectors are generated by genVectors, which relaxes the threshold in place
+VOCAB_CACHE_VERSION = "2"
+
+class Vocabulary:
+    """A set of named vectors, with constant time lookup by name.
+    
+    Iterating over a vocabulary gives (name, vector) pairs in insertion order, so it can
+    be used anywhere the old lists of [name, vector] pairs were."""
+    
+    def __init__(self, words=None):
+        self.names = []
+        self.vectors = []
+        self.indices = {}
+        self.flat = None
+        self.version = 0 #incremented whenever a vector changes (so caches can tell)
+        
+        if words != None:
+            for name,vec in words:
+                self.add(name, vec)
+    
+    def add(self, name, vec):
+        """Adds a word to the vocabulary (replacing the vector if the word is already present)."""
+        
+        if name in self.indices:
+            self.vectors[self.indices[name]] = vec
+            self.version = self.version + 1
+        else:
+            self.indices[name] = len(self.names)
+            self.names.append(name)
+            self.vectors.append(vec)
+        self.flat = None
+    
+    def get(self, name, default=None):
+        """Returns the vector for the given word (or default if it isn't in the vocabulary)."""
+        
+        i = self.indices.get(name)
+        if i == None:
+            return default
+        return self.vectors[i]
+    
+    def index(self, name):
+        """Returns the position of the given word (or None if it isn't in the vocabulary)."""
+        
+        return self.indices.get(name)
+    
+    def dimensions(self):
+        """Returns the dimension of the vectors in the vocabulary."""
+        
+        if len(self.vectors) == 0:
+            return 0
+        return len(self.vectors[0])
+    
+    def matrix(self):
+        """Returns all the vectors as one contiguous row-major array."""
+        
+        if self.flat == None:
+            flat = hrr.zeros(0)
+            for vec in self.vectors:
+                flat.extend(hrr.asArray(vec))
+            self.flat = flat
+        return self.flat
+    
+    def similarities(self, vec):
+        """Returns the similarity of vec to every word in the vocabulary."""
+        
+        return hrr.similarities(vec, self.vectors)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __contains__(self, name):
+        return name in self.indices
+    
+    def __iter__(self):
+        return iter(zip(self.names, self.vectors))
+    
+    def __getitem__(self, i):
+        return (self.names[i], self.vectors[i])
+
+#the Vocabulary made by asVocabulary for each plain list of [name, vector] pairs, by id(list),
+#as (list, the words and vectors it was made from, vocabulary)
+_wrappers = {}
+
+def asVocabulary(words):
+    """Returns words as a Vocabulary (words itself if it already is one).
+    
+    A plain list of [name, vector] pairs (leaving out any with a None name) is wrapped once
+    and the same Vocabulary is returned for it from then on, so caches keyed on the
+    vocabulary (e.g. the binding cache in matrixhandler) carry across callers. If the words
+    or vectors in the list have changed since, it gets a new Vocabulary."""
+    
+    if isinstance(words, Vocabulary):
+        return words
+    
+    #(the vectors are copied, since they may be changed in place)
+    current = [(name, tuple(vec)) for name,vec in words if name != None]
+    entry = _wrappers.get(id(words))
+    if entry != None and entry[0] is words and entry[1] == current:
+        return entry[2]
+    
+    vocab = Vocabulary([(name,vec) for name,vec in words if name != None])
+    
+    #(keeping a reference to words, so its id isn't reused while it is in here)
+    _wrappers[id(words)] = (words, current, vocab)
+    return vocab
 
 def genVocab(d, numwords, seed):
     """Calls the appropriate function for the given number of words in vocab."""
     
+    if RPMutils.CACHE_VOCAB:
+        cachefile = RPMutils.vocabCacheFile(d, numwords, seed)
+        vocab = loadVocabCache(cachefile, d)
+        if vocab != None:
+            return vocab
+    
+    vocab = None
     if numwords == 20:
         genVocab20(d, seed)
     elif numwords == 50:
         genVocab50(d, seed)
     elif numwords == 80:
-        return genVocab80(d,seed)
+        vocab = genVocab80(d,seed)
     else:
         System.err.println(str(numwords) + " is not a supported vocabulary")
+    
+    if RPMutils.CACHE_VOCAB and vocab != None:
+        saveVocabCache(vocab, cachefile)
+    
+    return vocab
+
+def _cacheNamesFile(filename):
+    return os.path.splitext(filename)[0] + ".names"
+
+def saveVocabCache(vocab, filename):
+    """Saves the vocabulary to a binary cache.
+    
+    The vectors are written as an (numwords x d) little-endian float64 .npy file, and the
+    words (plus the cache version and generation settings) to a .names file beside it."""
+    
+    n = len(vocab)
+    d = len(vocab[0][1])
+    
+    header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (n, d)
+    header = header + " " * (15 - (len(header) + 10) % 16) + "\n" #pad to a multiple of 16 bytes
+    
+    values = []
+    for name,vec in vocab:
+        values.extend(vec)
+    
+    def writeVectors(tmpname):
+        output = open(tmpname, "wb")
+        try:
+            output.write("\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header)
+            output.write(struct.pack("<%dd" % len(values), *values))
+        finally:
+            output.close()
+    
+    def writeNames(tmpname):
+        output = open(tmpname, "w")
+        try:
+            output.write(" ".join([VOCAB_CACHE_VERSION, str(RPMutils.VECTOR_SIMILARITY)]) + "\n")
+            for name,vec in vocab:
+                output.write(name + "\n")
+        finally:
+            output.close()
+    
+    #the names file is written last, so a cache is only valid once both files are complete
+    if RPMutils.writeAtomically(filename, writeVectors):
+        RPMutils.writeAtomically(_cacheNamesFile(filename), writeNames)
+
+def loadVocabCache(filename, d):
+    """Loads a vocabulary from a binary cache (returns None if there is no valid cache)."""
+    
+    namesfile = _cacheNamesFile(filename)
+    if not (os.path.exists(filename) and os.path.exists(namesfile)):
+        return None
+    
+    input = open(namesfile)
+    lines = input.read().splitlines()
+    input.close()
+    
+    if len(lines) < 1 or lines[0].split() != [VOCAB_CACHE_VERSION, str(RPMutils.VECTOR_SIMILARITY)]:
+        return None
+    names = lines[1:]
+    
+    input = open(filename, "rb")
+    data = input.read()
+    input.close()
+    
+    if not data.startswith("\x93NUMPY\x01\x00"):
+        return None
+    headerlen = struct.unpack("<H", data[8:10])[0]
+    start = 10 + headerlen
+    if len(data) - start != len(names) * d * 8:
+        return None
+    
+    values = struct.unpack("<%dd" % (len(names) * d), data[start:])
+    
+    return Vocabulary([(name, list(values[i*d:(i+1)*d])) for i,name in enumerate(names)])
 
 def saveVocab(d, numwords, seed, filename):
     """Saves the vocabulary to file."""
@@ -142,53 +334,56 @@ def genVocab80(d, seed):
     for i,name in enumerate(names):
         vocab[i][0] = name
     
+    vocab = Vocabulary([(name,vec) for name,vec in vocab if name != None])
+    
     #now the higher level vocab
-    norm = RPMutils.normalize
-    cconv = RPMutils.cconv
-    vecsum = RPMutils.vecsum
+    val = vocab.get
+    norm = hrr.normalizeInPlace
+    cconv = hrr.cconv
+    vecsum = hrr.add
     
     #number
-    vocab += [["two", norm(cconv(vocabVal("one",vocab), vocabVal("plusone",vocab)))]]
-    vocab += [["three", norm(cconv(vocabVal("two",vocab), vocabVal("plusone",vocab)))]]
-    vocab += [["four", norm(cconv(vocabVal("three",vocab), vocabVal("plusone",vocab)))]]
-    vocab += [["five", norm(cconv(vocabVal("four",vocab), vocabVal("plusone",vocab)))]]
-    vocab += [["six", norm(cconv(vocabVal("five",vocab), vocabVal("plusone",vocab)))]]
+    vocab.add("two", norm(cconv(val("one"), val("plusone"))))
+    vocab.add("three", norm(cconv(val("two"), val("plusone"))))
+    vocab.add("four", norm(cconv(val("three"), val("plusone"))))
+    vocab.add("five", norm(cconv(val("four"), val("plusone"))))
+    vocab.add("six", norm(cconv(val("five"), val("plusone"))))
     
     #angle
-    vocab += [["45deg", norm(cconv(vocabVal("0deg",vocab), vocabVal("plus45deg",vocab)))]]
-    vocab += [["90deg", norm(cconv(vocabVal("45deg",vocab), vocabVal("plus45deg",vocab)))]]
-    vocab += [["135deg", norm(cconv(vocabVal("90deg",vocab), vocabVal("plus45deg",vocab)))]]
-    vocab += [["180deg", norm(cconv(vocabVal("135deg",vocab), vocabVal("plus45deg",vocab)))]]
-    vocab += [["225deg", norm(cconv(vocabVal("180deg",vocab), vocabVal("plus45deg",vocab)))]]
-    vocab += [["270deg", norm(cconv(vocabVal("225deg",vocab), vocabVal("plus45deg",vocab)))]]
-    vocab += [["315deg", norm(cconv(vocabVal("270deg",vocab), vocabVal("plus45deg",vocab)))]]
+    vocab.add("45deg", norm(cconv(val("0deg"), val("plus45deg"))))
+    vocab.add("90deg", norm(cconv(val("45deg"), val("plus45deg"))))
+    vocab.add("135deg", norm(cconv(val("90deg"), val("plus45deg"))))
+    vocab.add("180deg", norm(cconv(val("135deg"), val("plus45deg"))))
+    vocab.add("225deg", norm(cconv(val("180deg"), val("plus45deg"))))
+    vocab.add("270deg", norm(cconv(val("225deg"), val("plus45deg"))))
+    vocab.add("315deg", norm(cconv(val("270deg"), val("plus45deg"))))
     
     #location
-    vocab += [["N", norm(cconv(vocabVal("NW",vocab), vocabVal("moveE",vocab)))]]
-    vocab += [["NE", norm(cconv(vocabVal("N",vocab), vocabVal("moveE",vocab)))]]
-    vocab += [["W", norm(cconv(vocabVal("NW",vocab), vocabVal("moveS",vocab)))]]
-    vocab += [["C", norm(cconv(vocabVal("W",vocab), vocabVal("moveE",vocab)))]]
-    vocab += [["E", norm(cconv(vocabVal("C",vocab), vocabVal("moveE",vocab)))]]
-    vocab += [["SW", norm(cconv(vocabVal("W",vocab), vocabVal("moveS",vocab)))]]
-    vocab += [["S", norm(cconv(vocabVal("SW",vocab), vocabVal("moveE",vocab)))]]
-    vocab += [["SE", norm(cconv(vocabVal("S",vocab), vocabVal("moveE",vocab)))]]
+    vocab.add("N", norm(cconv(val("NW"), val("moveE"))))
+    vocab.add("NE", norm(cconv(val("N"), val("moveE"))))
+    vocab.add("W", norm(cconv(val("NW"), val("moveS"))))
+    vocab.add("C", norm(cconv(val("W"), val("moveE"))))
+    vocab.add("E", norm(cconv(val("C"), val("moveE"))))
+    vocab.add("SW", norm(cconv(val("W"), val("moveS"))))
+    vocab.add("S", norm(cconv(val("SW"), val("moveE"))))
+    vocab.add("SE", norm(cconv(val("S"), val("moveE"))))
     
     #width/length
-    vocab += [["medium", norm(cconv(vocabVal("short",vocab), vocabVal("longer",vocab)))]]
-    vocab += [["long", norm(cconv(vocabVal("medium",vocab), vocabVal("longer",vocab)))]]
+    vocab.add("medium", norm(cconv(val("short"), val("longer"))))
+    vocab.add("long", norm(cconv(val("medium"), val("longer"))))
     
     #radialpos
-    vocab += [["middle", norm(cconv(vocabVal("inner",vocab), vocabVal("moveout",vocab)))]]
-    vocab += [["outer", norm(cconv(vocabVal("middle",vocab), vocabVal("moveout",vocab)))]]
+    vocab.add("middle", norm(cconv(val("inner"), val("moveout"))))
+    vocab.add("outer", norm(cconv(val("middle"), val("moveout"))))
     
     #shape
-    vocab += [["uptriangle", norm(cconv(vocabVal("triangle",vocab), vocabVal("90deg",vocab)))]]
-    vocab += [["downtriangle", norm(cconv(vocabVal("triangle",vocab), vocabVal("270deg",vocab)))]]
+    vocab.add("uptriangle", norm(cconv(val("triangle"), val("90deg"))))
+    vocab.add("downtriangle", norm(cconv(val("triangle"), val("270deg"))))
     
     #portion
-    vocab += [["whole", norm(vecsum(vocabVal("bottomhalf",vocab),vecsum(vocabVal("tophalf",vocab),vecsum(vocabVal("lefthalf",vocab),vocabVal("righthalf",vocab)))))]]
+    vocab.add("whole", norm(vecsum(val("bottomhalf"),vecsum(val("tophalf"),vecsum(val("lefthalf"),val("righthalf"))))))
     
-    return [[word[0],word[1]] for word in vocab if word[0] != None]
+    return Vocabulary([(name,hrr.toList(vec)) for name,vec in vocab])
 
 def genVocab50(d, seed):
     """Vocabulary for 50 base words."""
@@ -381,6 +576,9 @@ def genVocab20(d, seed):
 def vocabVal(name, vocab):
     """Returns the vector value for the given word."""
     
+    if isinstance(vocab, Vocabulary):
+        return vocab.get(name)
+    
     for n,v in vocab:
         if n == name:
             return v
@@ -394,37 +592,66 @@ def loadVocab(file):
     
     for line in input:
         splitline = line.split(" ", 1)
-        vocab = vocab + [[splitline[0], RPMutils.str2floatlist(splitline[1])]]
+        vocab.append([splitline[0], RPMutils.str2floatlist(splitline[1])])
+    input.close()
     
     return(vocab)
 
 def fillVectors(vocab, d, numwords, threshold = 1.0):
     """Fills the vocabulary with randomly generated vectors."""
     
-    numgen = 0
-    
-    timeout = 1000
+    vecs, relaxations = genVectors(d, numwords, threshold)
+    if relaxations > 0:
+        System.out.println("Timeout in fillVectors, needed " + str(relaxations) + 
+                           " relaxations to reach a threshold of " + str(threshold+0.1*relaxations))
     
-    while numgen < numwords:
-        vec = RPMutils.genVector(d)
-        
-        unique = True
-        for i in range(numgen):
-            if(RPMutils.similarity(vocab[i][1], vec) > threshold):
-                unique = False
-        
-        if unique:
-            vocab[numgen][1] = vec
-            numgen = numgen + 1
-            timeout = 1000
-        
-        timeout = timeout - 1
-        if timeout == 0:
-            System.out.println("Timeout in fillVectors, using threshold of " + str(threshold+0.1))
-            return(fillVectors(vocab, d, numwords, threshold+0.1))
+    for i,vec in enumerate(vecs):
+        vocab[i][1] = vec
     
     return(vocab)
 
+def genVectors(d, numwords, threshold = 1.0, timeout = 1000):
+    """Generates numwords random unit vectors whose pairwise similarity is at most threshold.
+    
+    Candidates are drawn in blocks (from the seeded PDFTools generator, so the result
+    is deterministic for a given seed) and each is compared against the accepted set,
+    stopping at the first vector it is too similar to. If timeout candidates in a row
+    are rejected the threshold is raised by 0.1, keeping the vectors accepted so far.
+    
+    Returns the vectors and the number of times the threshold had to be raised."""
+    
+    accepted = []
+    relaxations = 0
+    failures = 0
+    
+    while len(accepted) < numwords:
+        #draw only as many candidates as we still need, so that when nothing is
+        #rejected we consume exactly numwords vectors from the random stream
+        block = [RPMutils.genVector(d) for i in range(numwords - len(accepted))]
+        
+        for vec in block:
+            unique = True
+            
+            #unit vectors can't have a similarity greater than 1, so there is no need
+            #to compare them at all at the default threshold
+            if threshold < 1.0:
+                for other in accepted:
+                    if hrr.dot(other, vec) > threshold:
+                        unique = False
+                        break
+            
+            if unique:
+                accepted.append(vec)
+                failures = 0
+            else:
+                failures = failures + 1
+                if failures == timeout:
+                    threshold = threshold + 0.1
+                    relaxations = relaxations + 1
+                    failures = 0
+    
+    return accepted, relaxations
+
 
 
 def testSimilarity(vocab):
@@ -432,22 +659,74 @@ def testSimilarity(vocab):
     
     #we will count the average proportion of the vocabulary that is more than
     #threshold similar to each vector in the population
-    threshold = 0.3
-    vecs = [x[1] for x in vocab]
+    return similarityReport(vocab, 0.3)["proportion"]
+
+def similarityReport(vocab, threshold=0.3, blocksize=256, bins=20):
+    """Calculates statistics of the similarities between all the words in the vocabulary.
     
-    sim = 0.0
-    for i in range(len(vocab)):
-        count = 0.0
+    Returns a dictionary with
+        proportion: the average proportion of the vocabulary that is more than threshold
+                    similar to each word (the testSimilarity measure)
+        maxSimilarity: the largest similarity between two different words
+        maxPair: the names of those two words
+        neighbours: for each word, a (name, nearest other word, similarity) tuple
+        histogram: counts of the pairwise similarities in bins equal-width bins over [-1, 1]
+    
+    The Gram matrix is computed blocksize rows at a time (and only above the diagonal,
+    since it is symmetric), so memory stays bounded for large vocabularies."""
+    
+    names = [x[0] for x in vocab]
+    vecs = [x[1] for x in vocab]
+    n = len(vecs)
+    
+    counts = [0 for i in range(n)] #number of other words more than threshold similar to each word
+    nearest = [None for i in range(n)]
+    nearestsim = [None for i in range(n)]
+    histogram = [0 for i in range(bins)]
+    maxsim = None
+    maxpair = None
+    
+    for start in range(0, n, blocksize):
+        #the block of the (upper triangle of the) Gram matrix for these rows
+        block = [hrr.similarities(vecs[i], vecs[i+1:]) for i in range(start, min(start+blocksize, n))]
         
-        #count the number of vectors that exceed threshold
-        for j in range(len(vocab)):
-            if i != j:
-                if RPMutils.similarity(vecs[i],vecs[j]) > threshold:
-                    count += 1.0
-                    
-        count /= len(vocab)
-        sim += count
-    
-    sim /= len(vocab)
-    
-    return sim
\ No newline at end of file
+        for k,row in enumerate(block):
+            i = start + k
+            for offset,sim in enumerate(row):
+                j = i + 1 + offset
+                
+                if sim > threshold:
+                    counts[i] += 1
+                    counts[j] += 1
+                
+                if nearestsim[i] == None or sim > nearestsim[i]:
+                    nearest[i] = j
+                    nearestsim[i] = sim
+                if nearestsim[j] == None or sim > nearestsim[j]:
+                    nearest[j] = i
+                    nearestsim[j] = sim
+                
+                if maxsim == None or sim > maxsim:
+                    maxsim = sim
+                    maxpair = (names[i], names[j])
+                
+                histogram[min(max(int((sim + 1.0) / 2.0 * bins), 0), bins-1)] += 1
+    
+    proportion = 0.0
+    for count in counts:
+        proportion += float(count) / n
+    if n > 0:
+        proportion /= n
+    
+    neighbours = []
+    for i in range(n):
+        if nearest[i] == None:
+            neighbours.append((names[i], None, None))
+        else:
+            neighbours.append((names[i], names[nearest[i]], nearestsim[i]))
+    
+    return {"proportion": proportion,
+            "maxSimilarity": maxsim,
+            "maxPair": maxpair,
+            "neighbours": neighbours,
+            "histogram": histogram}
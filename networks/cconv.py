@@ -6,45 +6,96 @@ from ca.nengo.model import SimulationMode
 from ca.nengo.model.impl import NetworkImpl
 
 from misc import RPMutils
+from misc import fft
+from misc import sparse
+from networks import directnode
 from networks import networkensemble
 from networks import eprod
 
+#the DFT weight matrices only depend on d, so they are computed once per dimension and
+#shared by every Cconv network. they must be treated as read-only.
+_weights = {}
+
+def _cached(kind, d, build):
+    key = (kind, d)
+    W = _weights.get(key)
+    if W == None:
+        W = build(d)
+        _weights[key] = W
+    return W
+
+def _table(d):
+    #the DFT matrices only ever use the angles -2*pi*k/d, for k = i*j mod d
+    return _cached("table", d, lambda d: ([math.cos(-2 * math.pi * k / d) for k in range(d)],
+                                          [math.sin(-2 * math.pi * k / d) for k in range(d)]))
+
+def _dft(table, rows, d, scale):
+    return [[scale * table[(i*j) % d] for j in range(d)] for i in range(rows)]
+
+def calcWreal(d):
+    """Real part of the FFT matrix (for the first d/2+1 frequencies)."""
+    return _cached("Wreal", d, lambda d: _dft(_table(d)[0], int(d/2)+1, d, 1.0 / math.sqrt(d)))
+
+def calcWimag(d):
+    """Imaginary part of the FFT matrix (for the first d/2+1 frequencies)."""
+    return _cached("Wimag", d, lambda d: _dft(_table(d)[1], int(d/2)+1, d, 1.0 / math.sqrt(d)))
+
+def calcInvWreal(d, scale=1.0):
+    """Real part of the IFFT matrix, multiplied by scale."""
+    return _cached(("invWreal", scale), d, lambda d: _dft(_table(d)[0], d, d, scale))
+
+def calcInvWimag(d, scale=1.0):
+    """Imaginary part of the IFFT matrix, multiplied by scale."""
+    return _cached(("invWimag", scale), d, lambda d: _dft(_table(d)[1], d, d, -scale))
+
+def calcExpand(d):
+    """Matrices for expanding the real (and negated real) and imaginary half-spectra to all d frequencies.
+    
+    note: all this halfd/expansion stuff is because the fft of a real value
+    is symmetrical, so we do all our computations on just one half and then
+    add in the symmetrical other half at the end"""
+    
+    def build(d):
+        halfd = int(d/2)+1
+        
+        #the first halfd frequencies are copied, and the rest mirror the ones below the midpoint
+        #(negated, for the imaginary components). these are all one-hot selector matrices.
+        midpoint = halfd-1-(d+1)%2
+        mirror = [midpoint - i for i in range(int(math.ceil(d/2.0)-1))]
+        
+        #matrix for expanding real half-vectors (with negative for subtraction)
+        expand = sparse.Selector(range(halfd) + mirror, halfd, 1)
+        negexpand = expand.scale(-1)
+        
+        #matrix for expanding imaginary half-vectors
+        imagexpand = sparse.Selector(range(halfd) + mirror, halfd, [1]*halfd + [-1]*len(mirror))
+        
+        return expand, negexpand, imagexpand
+    
+    return _cached("expand", d, build)
+
+def directCconv(name, d, tauPSC):
+    """Returns a single node that computes the circular convolution of its A and B inputs
+    with an FFT each timestep (used in place of the whole Cconv network in DIRECT mode)."""
+    
+    return directnode.directNode(name, fft.cconv, d, d, d, tauPSC)
+
 class Cconv(NetworkImpl):
     #calculate real part of FFT matrix
     def calcWreal(self, d):
-        W = [[0 for x in range(d)] for x in range(int(d/2)+1)]
-        for i in range(int(d/2)+1):
-            for j in range(d):
-                W[i][j] = math.cos(-2 * math.pi * (i*j) / d) / math.sqrt(d)
-        
-        return(W)
+        return calcWreal(d)
     
     #calculate imaginary part of FFT matrix
     def calcWimag(self, d):
-        W = [[0 for x in range(d)] for x in range(int(d/2)+1)]
-        for i in range(int(d/2)+1):
-            for j in range(d):
-                W[i][j] = math.sin(-2 * math.pi * (i*j) / d) / math.sqrt(d)
-                
-        return(W)
+        return calcWimag(d)
     
     #calculate real part of IFFT matrix
     def calcInvWreal(self, d):
-        W = [[0 for x in range(d)] for x in range(d)]
-        for i in range(d):
-            for j in range(d):
-                W[i][j] = math.cos(-2 * math.pi * (i*j) / d)
-        
-        return(W)
+        return calcInvWreal(d)
     
     #calculate imaginary part of IFFT matrix
     def calcInvWimag(self, d):
-        W = [[0 for x in range(d)] for x in range(d)]
-        for i in range(d):
-            for j in range(d):
-                W[i][j] = -math.sin(-2 * math.pi * (i*j) / d)
-    
-        return(W)
+        return calcInvWimag(d)
     
     def __init__(self, name, N, d):
         NetworkImpl.__init__(self)
@@ -52,8 +103,22 @@ class Cconv(NetworkImpl):
         
         tauPSC = 0.007
         
-        Wr = self.calcWreal(d)
-        Wi = self.calcWimag(d)
+        if RPMutils.SIMULATION_MODE == SimulationMode.DIRECT:
+            #in direct mode the populations just compute the ideal functions, so the whole
+            #network can be replaced by one node that does the convolution directly
+            conv = directCconv("conv", d, tauPSC)
+            self.addNode(conv)
+            
+            if RPMutils.USE_PROBES:
+                self.simulator.addProbe("conv", "X", True)
+            
+            self.exposeTermination(conv.getTermination("A"), "A")
+            self.exposeTermination(conv.getTermination("B"), "B")
+            self.exposeOrigin(conv.getOrigin("X"), "X")
+            return
+        
+        Wr = calcWreal(d)
+        Wi = calcWimag(d)
             
         halfd = int(d/2)+1
         halfN = int(math.ceil(float(N) * halfd/d))
@@ -62,17 +127,19 @@ class Cconv(NetworkImpl):
         netef = networkensemble.NetworkEnsemble(ef)
         
         #create input populations
-        A = ef.make("A", 1, d)
-        A.addDecodedTermination("input", RPMutils.eye(d,1), 0.0001, False)
-        A.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
-        A.fixMode()
-        self.addNode(A)
-        
-        B = ef.make("B", 1, d)
-        B.addDecodedTermination("input", RPMutils.eye(d,1), 0.0001, False)
-        B.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
-        B.fixMode()
-        self.addNode(B)
+        collapse = RPMutils.COLLAPSE_RELAYS
+        if not collapse:
+            A = ef.make("A", 1, d)
+            A.addDecodedTermination("input", RPMutils.eye(d,1), 0.0001, False)
+            A.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
+            A.fixMode()
+            self.addNode(A)
+            
+            B = ef.make("B", 1, d)
+            B.addDecodedTermination("input", RPMutils.eye(d,1), 0.0001, False)
+            B.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
+            B.fixMode()
+            self.addNode(B)
 
         #this is the new method, where we collapse the fft into the eprod
         #populations to calculate the element-wise product of our vectors so far
@@ -93,33 +160,13 @@ class Cconv(NetworkImpl):
         
         for i in range(4):
             self.addNode(eprods[i])
-                
-            self.addProjection(A.getOrigin("X"), eprods[i].getTermination("A"))
-            self.addProjection(B.getOrigin("X"), eprods[i].getTermination("B"))
-
-    
-        #negative identity matrix (for subtraction)
-        negidentity = [[0 for x in range(d)] for x in range(d)]
-        for i in range(d):
-            negidentity[i][i] = -1 
-        
-        #note: all this halfd/expansion stuff is because the fft of a real value
-        #is symmetrical, so we do all our computations on just one half and then
-        #add in the symmetrical other half at the end
-        
-        #matrix for expanding real half-vectors (with negative for subtraction)
-        expand = RPMutils.eye(halfd,1)
-        negexpand = RPMutils.eye(halfd, -1)
-        
-        #matrix for expanding imaginary half-vectors
-        imagexpand = RPMutils.eye(halfd,1)
-       
-        midpoint = halfd-1-(d+1)%2
-        for i in range(int(math.ceil(d/2.0)-1)):
-            expand = expand + [expand[midpoint - i]]
-            negexpand = negexpand + [negexpand[midpoint - i]]
             
-            imagexpand = imagexpand + [[-x for x in imagexpand[midpoint - i]]]
+            if not collapse:
+                self.addProjection(A.getOrigin("X"), eprods[i].getTermination("A"))
+                self.addProjection(B.getOrigin("X"), eprods[i].getTermination("B"))
+
+        #expansion matrices for the symmetrical halves of the spectrum
+        expand, negexpand, imagexpand = calcExpand(d)
         
         #multiply real components
         rprod = netef.make("rprod", N, tauPSC, [expand, negexpand], None)
@@ -135,18 +182,9 @@ class Cconv(NetworkImpl):
         
         #now calculate IFFT of Z = (rprod) + (iprod)i
         #we only need to calculate the real part, since we know the imaginary component is 0
-        Winvr = self.calcInvWreal(d)
-        Winvi = self.calcInvWimag(d)
-        
-        for i in range(d):
-            for j in range(d):
-                Winvr[i][j] = Winvr[i][j] * (1.0/multscale)
-                Winvi[i][j] = Winvi[i][j] * (1.0/multscale)
-            
-        negWinvi = [[0 for x in range(d)] for x in range(d)]
-        for i in range(d):
-            for j in range(d):
-                negWinvi[i][j] = -Winvi[i][j]
+        #(the 1/multscale undoes the scale we applied in the eprods)
+        Winvr = calcInvWreal(d, 1.0/multscale)
+        negWinvi = calcInvWimag(d, -1.0/multscale)
             
         result = netef.make("result", N, tauPSC, [Winvr, negWinvi], None)
         
@@ -156,8 +194,9 @@ class Cconv(NetworkImpl):
         self.addProjection(iprod.getOrigin("X"), result.getTermination("in_1"))
         
         if RPMutils.USE_PROBES:
-            self.simulator.addProbe("A", "X", True)
-            self.simulator.addProbe("B", "X", True)
+            if not collapse:
+                self.simulator.addProbe("A", "X", True)
+                self.simulator.addProbe("B", "X", True)
             self.simulator.addProbe("eprod0", "X", True)
             self.simulator.addProbe("eprod1", "X", True)
             self.simulator.addProbe("eprod2", "X", True)
@@ -166,6 +205,10 @@ class Cconv(NetworkImpl):
             self.simulator.addProbe("iprod", "X", True)
             self.simulator.addProbe("result", "X", True)
         
-        self.exposeTermination(A.getTermination("input"), "A")
-        self.exposeTermination(B.getTermination("input"), "B")
+        if collapse:
+            RPMutils.exposeTerminations(self, [e.getTermination("A") for e in eprods], "A")
+            RPMutils.exposeTerminations(self, [e.getTermination("B") for e in eprods], "B")
+        else:
+            self.exposeTermination(A.getTermination("input"), "A")
+            self.exposeTermination(B.getTermination("input"), "B")
         self.exposeOrigin(result.getOrigin("X"), "X")
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""A single node that computes a function of two inputs directly, used in place of whole networks in DIRECT mode."""
+
+import nef
+
+def directNode(name, compute, adims, bdims, outdims, tauPSC):
+    """Returns a node with terminations A (adims dimensions) and B (bdims dimensions), whose
+    origin X (outdims dimensions) outputs compute(a, b) of the latest inputs each timestep.
+    
+    SimpleNode reads the termination dimensions from the default arguments, so the class is
+    defined here where they are known. Classes defined in a function can't be loaded from a
+    snapshot, so networks built in DIRECT mode aren't snapshotted (see makeSequenceSolver)."""
+    
+    class DirectNode(nef.SimpleNode):
+        def init(self):
+            self.a = [0.0 for i in range(adims)]
+            self.b = [0.0 for i in range(bdims)]
+            self.result = [0.0 for i in range(outdims)]
+        
+        def termination_A(self, x, dimensions=adims, pstc=tauPSC):
+            self.a = x
+        
+        def termination_B(self, x, dimensions=bdims, pstc=tauPSC):
+            self.b = x
+        
+        def tick(self):
+            self.result = compute(self.a, self.b)
+        
+        def origin_X(self):
+            return self.result
+    
+    return DirectNode(name)
@@ -0,0 +1,42 @@
+"""Arrays of identical populations (one per dimension) that look like a single population.
+
+These are Nengo's own NetworkArrayImpl, made from template populations. A decoded termination
+of the array is split row-wise between the populations, and an origin of the array is the
+populations' origins concatenated, so no relay populations are needed. They are only used
+with COLLAPSE_RELAYS, since leaving out the output relays changes the dynamics of the network
+(one fewer synaptic filter)."""
+
+import jarray
+
+from ca.nengo.model import StructuralException
+from ca.nengo.model.impl import NetworkArrayImpl
+from ca.nengo.model.nef.impl import NEFEnsembleImpl
+
+from misc import RPMutils
+
+def makeArray(name, ef, n, N, d=1, prefix="pop_", setup=None, setupKey=None):
+    """Returns an array of n populations of N neurons, each representing d dimensions.
+
+    The populations are made with RPMutils.makeFromTemplate, so with REUSE_POPULATIONS they
+    share one set of neuron parameters and decoders."""
+
+    pops = [RPMutils.makeFromTemplate(ef, prefix + str(i), N, d, setup, setupKey) for i in range(n)]
+    return NetworkArrayImpl(name, jarray.array(pops, NEFEnsembleImpl))
+
+def stack(transforms):
+    """Returns the transform of an array termination, given the transform for each population."""
+
+    matrix = []
+    for transform in transforms:
+        matrix.extend(transform)
+    return matrix
+
+def getOrigin(array, name):
+    """Returns the origin of the array that concatenates the populations' origins with the
+    given name (creating it the first time, except for X which the array always has)."""
+
+    try:
+        return array.getOrigin(name)
+    except StructuralException:
+        array.createEnsembleOrigin(name)
+        return array.getOrigin(name)
@@ -10,8 +10,48 @@ import math
 from java.lang import System
 
 from misc import RPMutils
+from misc import sparse
+from networks import directnode
+from networks import ensemblearray
 from misc.vectorgenerators import *
 
+def directEprod(name, d, weights, scale, oneDinput, tauPSC):
+    """Returns a single node that computes (C1*input1 .* C2*input2)*scale each timestep (used
+    in place of the multiplication populations in DIRECT mode). weights are [C1, C2], or None
+    for the identity."""
+    
+    if weights == None:
+        weights = [sparse.identity(d), sparse.identity(d)]
+    inputd = len(weights[0][0])
+    
+    bd = inputd
+    rowsums = None
+    if oneDinput:
+        #the second input is a scalar, which is expanded to a full vector of that value
+        bd = 1
+        rowsums = sparse.rowSums(weights[1])
+    
+    def compute(a, b):
+        #O(d) for structured weights (e.g. the default identity)
+        a = sparse.apply(weights[0], a)
+        
+        if rowsums != None:
+            b = [b[0] * x for x in rowsums]
+        else:
+            b = sparse.apply(weights[1], b)
+        
+        return [x * y * scale for x,y in zip(a, b)]
+    
+    return directnode.directNode(name, compute, inputd, bd, d, tauPSC)
+
+def productOrigin(scale):
+    """Returns a function that adds an origin computing the product of the two components
+    represented by a population (times scale)."""
+    
+    def addOrigin(pop):
+        pop.addDecodedOrigin("output", [PostfixFunction("x0*x1*%.12f" % scale, 2)], "AXON")
+    return addOrigin
+
 class Eprod(NetworkImpl):
     def __init__(self, name, N, d, scale=1.0, weights = None, maxinput=1.0, oneDinput=False):
         #scale is a scale on the output of the multiplication
@@ -41,8 +81,20 @@ class Eprod(NetworkImpl):
         if weights != None and len(weights) != 2:
             System.out.println("Warning, other than 2 matrices given to eprod")
         
+        if RPMutils.SIMULATION_MODE == SimulationMode.DIRECT:
+            #in direct mode the populations just compute the ideal functions, so all the
+            #multiplications can be done at once by one node (rather than interpreting
+            #a postfix expression for each dimension every timestep)
+            prod = directEprod("prod", d, weights, scale, oneDinput, tauPSC)
+            self.addNode(prod)
+            
+            self.exposeTermination(prod.getTermination("A"), "A")
+            self.exposeTermination(prod.getTermination("B"), "B")
+            self.exposeOrigin(prod.getOrigin("X"), "X")
+            return
+        
         if weights == None:
-            weights = [RPMutils.eye(d,1),RPMutils.eye(d,1)]
+            weights = [sparse.identity(d), sparse.identity(d)]
             
         inputd = len(weights[0][0])
             
@@ -50,23 +102,30 @@ class Eprod(NetworkImpl):
         ef=RPMutils.defaultEnsembleFactory()
         
         #create input populations
-        in1 = ef.make("in1", 1, inputd)
-        in1.addDecodedTermination("input", RPMutils.eye(inputd, 1), 0.0001, False)
-        self.addNode(in1)
-        in1.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
-        in1.fixMode()
-        
-        
-        in2 = ef.make("in2", 1, inputd)
-        if not oneDinput:
-            in2.addDecodedTermination("input", RPMutils.eye(inputd, 1), 0.0001, False)
-        else:
+        in2transform = RPMutils.eye(inputd, 1)
+        if oneDinput:
             #if it is a 1-D input we just expand it to a full vector of that value so that we
             #can treat it as an element-wise product
-            in2.addDecodedTermination("input", [[1] for i in range(inputd)], 0.0001, False)
-        self.addNode(in2)
-        in2.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
-        in2.fixMode()
+            in2transform = [[1] for i in range(inputd)]
+        
+        #if we are collapsing relays the inputs go straight to the terminations of the
+        #multiplication populations, so we collect those terminations instead
+        collapse = RPMutils.COLLAPSE_RELAYS
+        aTerms = []
+        bTerms = []
+        
+        if not collapse:
+            in1 = ef.make("in1", 1, inputd)
+            in1.addDecodedTermination("input", RPMutils.eye(inputd, 1), 0.0001, False)
+            self.addNode(in1)
+            in1.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
+            in1.fixMode()
+            
+            in2 = ef.make("in2", 1, inputd)
+            in2.addDecodedTermination("input", in2transform, 0.0001, False)
+            self.addNode(in2)
+            in2.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
+            in2.fixMode()
             
         
         #ensemble for intermediate populations
@@ -77,38 +136,62 @@ class Eprod(NetworkImpl):
         multef.nodeFactory.intercept=IndicatorPDF(-1, 1)
         multef.encoderFactory = MultiplicationVectorGenerator()
         multef.beQuiet()
+        RPMutils.shareEvalPoints(multef)
     
     
-        result = ef.make("result", 1, d)
-        result.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
-        result.fixMode()
-        self.addNode(result)
-        
-        if RPMutils.SPLIT_DIMENSIONS:
+        if RPMutils.SPLIT_DIMENSIONS and collapse:
+            zeros = [0 for x in range(inputd)]
+            
+            #create a 2D population for each input dimension which will combine the components from
+            #one dimension of each of the input populations, in an array whose output origin is the
+            #products concatenated (so there is no result relay). the product is scaled by maxlength**2
+            #to undo our maxlength manipulations (we scale each input by 1/maxlength, then multiply
+            #them together for a total scale of 1/maxlength**2), and then by the output scale. the
+            #product origin is the same for every dimension, so with REUSE_POPULATIONS its decoders
+            #are only solved once.
+            outscale = maxlength**2 * scale
+            mpop = ensemblearray.makeArray("mpop", multef, d, smallN, 2, prefix="mpop_", 
+                                           setup=productOrigin(outscale), setupKey=("product", outscale))
+            
+            #each population selects one component from each of the inputs (its rows of the array's
+            #terminations). we divide by maxlength to ensure that the maximum length of the 2D vector is 1  
+            #remember that (for some reason) the convention in Nengo is that the input matrices are transpose of what they should be mathematically  
+            atransform = ensemblearray.stack([[[(1.0 / maxlength) * x for x in weights[0][e]], zeros] for e in range(d)])
+            if oneDinput:
+                #fold the expansion of the 1-D input into the termination
+                btransform = ensemblearray.stack([[[0], [(1.0 / maxlength) * sum(weights[1][e])]] for e in range(d)])
+            else:
+                btransform = ensemblearray.stack([[zeros, [(1.0 / maxlength) * x for x in weights[1][e]]] for e in range(d)])
+            mpop.addDecodedTermination('a', atransform, tauPSC, False)
+            mpop.addDecodedTermination('b', btransform, tauPSC, False)
+            self.addNode(mpop)
+            
+            aTerms.append(mpop.getTermination('a'))
+            bTerms.append(mpop.getTermination('b'))
+            
+            output = ensemblearray.getOrigin(mpop, "output")
+        elif RPMutils.SPLIT_DIMENSIONS:
+            result = ef.make("result", 1, d)
+            result.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
+            result.fixMode()
+            self.addNode(result)
+            
             resultTerm = [[0] for x in range(d)]
             zeros = [0 for x in range(inputd)]
-            one = [0 for x in range(inputd)]
             
-            mpop = []
             for e in range(d):
                 #create a 2D population for each input dimension which will combine the components from
                 #one dimension of each of the input populations
-                mpop = multef.make('mpop_' + str(e), smallN, 2)
+                #(the product origin is the same for every dimension, so with REUSE_POPULATIONS
+                #its decoders are only solved once)
+                mpop = RPMutils.makeFromTemplate(multef, 'mpop_' + str(e), smallN, 2, productOrigin(1.0), ("product", 1.0))
                 
                 #make two connection that will select one component from each of the input pops 
                 #we divide by maxlength to ensure that the maximum length of the 2D vector is 1  
                 #remember that (for some reason) the convention in Nengo is that the input matrices are transpose of what they should be mathematically  
-                for i in range(inputd):
-                    one[i] = (1.0 / maxlength) * weights[0][e][i]
-                mpop.addDecodedTermination('a', [one, zeros], tauPSC, False)
+                mpop.addDecodedTermination('a', [[(1.0 / maxlength) * x for x in weights[0][e]], zeros], tauPSC, False)
+                mpop.addDecodedTermination('b', [zeros, [(1.0 / maxlength) * x for x in weights[1][e]]], tauPSC, False) 
                 
-                for i in range(inputd):
-                    one[i] = (1.0 / maxlength) * weights[1][e][i]
-                mpop.addDecodedTermination('b', [zeros, one], tauPSC, False) 
-                one = [0 for x in range(inputd)]
-                
-                #multiply the two selected components together
-                mpop.addDecodedOrigin("output", [PostfixFunction('x0*x1', 2)], "AXON")
                 self.addNode(mpop)
                 self.addProjection(in1.getOrigin('X'), mpop.getTermination('a'))
                 self.addProjection(in2.getOrigin('X'), mpop.getTermination('b'))
@@ -121,24 +204,43 @@ class Eprod(NetworkImpl):
                 resultTerm[e] = [0]
                 
                 self.addProjection(mpop.getOrigin('output'), result.getTermination('in_' + str(e)))
+            
+            output = result.getOrigin("X")
         else:
             #do all the multiplication in one population rather than splitting it up by dimension. note that this will
             #only really work in direct mode.
             
+            result = ef.make("result", 1, d)
+            result.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
+            result.fixMode()
+            self.addNode(result)
+            
             mpop = ef.make("mpop", N, 2*d)
-            mpop.addDecodedTermination("a", weights[0] + [[0 for x in range(inputd)] for y in range(d)], tauPSC, False)
-            mpop.addDecodedTermination("b", [[0 for x in range(inputd)] for y in range(d)] + weights[1], tauPSC, False)
+            mpop.addDecodedTermination("a", sparse.dense(weights[0]) + [[0 for x in range(inputd)] for y in range(d)], tauPSC, False)
+            btransform = [[0 for x in range(inputd)] for y in range(d)] + sparse.dense(weights[1])
+            if collapse and oneDinput:
+                btransform = RPMutils.matrixProduct(btransform, in2transform)
+            mpop.addDecodedTermination("b", btransform, tauPSC, False)
             mpop.addDecodedOrigin("output", [PostfixFunction("x" + str(i) + "*x" + str(d+i), 2*d) for i in range(d)], "AXON")
             self.addNode(mpop)
             
-            self.addProjection(in1.getOrigin("X"), mpop.getTermination("a"))
-            self.addProjection(in2.getOrigin("X"), mpop.getTermination("b"))
+            if collapse:
+                aTerms.append(mpop.getTermination("a"))
+                bTerms.append(mpop.getTermination("b"))
+            else:
+                self.addProjection(in1.getOrigin("X"), mpop.getTermination("a"))
+                self.addProjection(in2.getOrigin("X"), mpop.getTermination("b"))
             
             result.addDecodedTermination("input", RPMutils.eye(d,scale), tauPSC, False)
             self.addProjection(mpop.getOrigin("output"), result.getTermination("input"))
+            
+            output = result.getOrigin("X")
         
-        
-        self.exposeTermination(in1.getTermination("input"), "A")
-        self.exposeTermination(in2.getTermination("input"), "B")
-        self.exposeOrigin(result.getOrigin("X"), "X")
+        if collapse:
+            RPMutils.exposeTerminations(self, aTerms, "A")
+            RPMutils.exposeTerminations(self, bTerms, "B")
+        else:
+            self.exposeTermination(in1.getTermination("input"), "A")
+            self.exposeTermination(in2.getTermination("input"), "B")
+        self.exposeOrigin(output, "X")
         
\ No newline at end of file
@@ -8,7 +8,9 @@ from ca.nengo.math.impl import *
 import math
 
 from misc import RPMutils
+from misc import sparse
 from networks import networkensemble
+from networks import ensemblearray
 
 class Integrator(NetworkImpl):
     def __init__(self, name, N, d, inputScale=1.0, forgetRate = 0.0, stepsize=1.0):
@@ -36,51 +38,64 @@ class Integrator(NetworkImpl):
         intef.nodeFactory.intercept = IndicatorPDF(-1, 1)
         intef.beQuiet()
         
-        input = netef.make("input", N, 0.05, [RPMutils.eye(d, 1)], None) #note we run this in non-direct mode to eliminate the "bumps"
+        input = netef.make("input", N, 0.05, [sparse.identity(d)], None) #note we run this in non-direct mode to eliminate the "bumps"
         self.addNode(input)   
         
-        output = ef.make("output", 1, d)
-        output.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
-        output.fixMode()
-        self.addNode(output)
-        
-        if RPMutils.SPLIT_DIMENSIONS:
-            invec = [0 for x in range(d)]
-            resultTerm = [[0] for x in range(d)]
-            
+        if RPMutils.SPLIT_DIMENSIONS and RPMutils.COLLAPSE_RELAYS:
+            #one integrator population per dimension, in an array whose X origin is the populations'
+            #outputs concatenated (so there is no output relay). each population gets its row of
+            #the input transform, and feeds back to itself.
+            intpop = ensemblearray.makeArray("intpop", intef, d, smallN, prefix="intpop_")
+            intpop.addDecodedTermination("input", RPMutils.eye(d, inputWeight), tauPSC, False)
             for i in range(d):
-                intpop = intef.make("intpop_" + str(i), smallN, 1)
+                pop = intpop.getNode("intpop_" + str(i))
+                pop.addDecodedTermination("feedback", [[recurWeight]], intPSC, False)
+                intpop.addProjection(pop.getOrigin("X"), pop.getTermination("feedback"))
+            self.addNode(intpop)
+            
+            self.addProjection(input.getOrigin("X"), intpop.getTermination("input"))
+            
+            self.exposeOrigin(intpop.getOrigin("X"), "X")
+        else:
+            output = ef.make("output", 1, d)
+            output.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
+            output.fixMode()
+            self.addNode(output)
+            
+            if RPMutils.SPLIT_DIMENSIONS:
+                selector = sparse.identity(d, inputWeight)
+                resultTerm = [[0] for x in range(d)]
                 
-                invec[i] = inputWeight
-                intpop.addDecodedTermination("input", [invec], tauPSC, False)
-                invec[i] = 0
-                intpop.addDecodedTermination("feedback", [[recurWeight]], intPSC, False)
+                for i in range(d):
+                    intpop = RPMutils.makeFromTemplate(intef, "intpop_" + str(i), smallN, 1)
+                    
+                    intpop.addDecodedTermination("input", [selector.row(i)], tauPSC, False)
+                    intpop.addDecodedTermination("feedback", [[recurWeight]], intPSC, False)
+                    self.addNode(intpop)
+                    
+                    self.addProjection(input.getOrigin("X"), intpop.getTermination("input"))
+                    self.addProjection(intpop.getOrigin("X"), intpop.getTermination("feedback"))
+                    
+                    resultTerm[i] = [1]
+                    output.addDecodedTermination("in_" + str(i), resultTerm, 0.0001, False)
+                    resultTerm[i] = [0]
+                    
+                    self.addProjection(intpop.getOrigin("X"), output.getTermination("in_" + str(i)))
+            else:
+                #do all the integration in one population rather than dividing it up by dimension. note that
+                #this will only really work in direct mode.
+                
+                intpop = intef.make("intpop", N, d)
+                intpop.addDecodedTermination("input", RPMutils.eye(d,inputWeight), tauPSC, False)
+                intpop.addDecodedTermination("feedback", RPMutils.eye(d,recurWeight), intPSC, False)
                 self.addNode(intpop)
                 
                 self.addProjection(input.getOrigin("X"), intpop.getTermination("input"))
                 self.addProjection(intpop.getOrigin("X"), intpop.getTermination("feedback"))
                 
-                resultTerm[i] = [1]
-                output.addDecodedTermination("in_" + str(i), resultTerm, 0.0001, False)
-                resultTerm[i] = [0]
-                
-                self.addProjection(intpop.getOrigin("X"), output.getTermination("in_" + str(i)))
-        else:
-            #do all the integration in one population rather than dividing it up by dimension. note that
-            #this will only really work in direct mode.
-            
-            intpop = intef.make("intpop", N, d)
-            intpop.addDecodedTermination("input", RPMutils.eye(d,inputWeight), tauPSC, False)
-            intpop.addDecodedTermination("feedback", RPMutils.eye(d,recurWeight), intPSC, False)
-            self.addNode(intpop)
-            
-            self.addProjection(input.getOrigin("X"), intpop.getTermination("input"))
-            self.addProjection(intpop.getOrigin("X"), intpop.getTermination("feedback"))
-            
-            output.addDecodedTermination("in", RPMutils.eye(d,1), 0.0001, False)
-            self.addProjection(intpop.getOrigin("X"), output.getTermination("in"))
+                output.addDecodedTermination("in", RPMutils.eye(d,1), 0.0001, False)
+                self.addProjection(intpop.getOrigin("X"), output.getTermination("in"))
             
+            self.exposeOrigin(output.getOrigin("X"), "X")
         
         self.exposeTermination(input.getTermination("in_0"), "input")
-        self.exposeOrigin(output.getOrigin("X"), "X")           
-        
\ No newline at end of file
@@ -0,0 +1,93 @@
+"""Pure math version of the SequenceSolver network (for fast evaluation of many matrices)."""
+
+from misc import RPMutils
+from misc import hrr
+
+class MathSequenceSolver:
+    """Computes what SequenceSolver computes, using ideal vector operations instead of neurons.
+
+    The rule T is the leaky integral of the correlations of the example pairs (as in
+    Transform/Average/Integrator), the hypothesis is the convolution of T with the second
+    last cell (as in calcLast), and the scores are the similarity of the hypothesis to each
+    answer, scaled as in the Similarity network. Synaptic filtering is ignored, so this
+    matches the network run in DIRECT mode up to the small PSC transients.
+
+    The input signals are piecewise constant, so the integrator is advanced over each
+    STEP_SIZE segment in closed form rather than one timestep at a time."""
+
+    def __init__(self, d, matrix, inputScale=0.4, forgetRate=0.2, dt=0.001):
+        #matrix is the encoded matrix followed by the encoded answers, as given to SequenceSolver
+        self.d = d
+        self.matrix = matrix
+        self.inputScale = inputScale
+        self.forgetRate = forgetRate
+        self.dt = dt
+        self.stepsize = RPMutils.STEP_SIZE
+
+        self.scaleFactor = 0.1 #the scale on the answer similarities in the Similarity network
+
+        #the pairs presented to calcT, one per STEP_SIZE (see SequenceSolver.loadSequenceMatrix)
+        Ain = [matrix[i] for i in [0,1,3,4,6]]
+        Bin = [matrix[i] for i in [1,2,4,5,7]]
+
+        #Transform correlates each pair by convolving B with the approximate inverse of A
+        self.corr = RPMutils.cconvBatch([hrr.ainv(a) for a in Ain], Bin)
+
+        self.secondLast = matrix[7]
+        self.answers = matrix[8:16]
+
+    def endTime(self):
+        """Returns the time at which the last example pair stops being presented."""
+
+        return len(self.corr) * self.stepsize
+
+    def calcT(self, time=None):
+        """Returns the rule T at the given time (default endTime())."""
+
+        if time == None:
+            time = self.endTime()
+
+        steps = int(round(time / self.dt))
+        segment = int(round(self.stepsize / self.dt))
+
+        #integrator update each timestep: T += dt/stepsize * (inputScale*input - forgetRate*T)
+        leak = 1.0 - self.dt / self.stepsize * self.forgetRate
+
+        T = hrr.zeros(self.d)
+        for corr in self.corr + [None]: #the input is zero after the last pair
+            if steps <= 0:
+                break
+
+            n = steps
+            if corr != None:
+                n = min(steps, segment)
+            steps = steps - n
+
+            if corr == None:
+                T = hrr.scale(T, leak**n)
+            elif self.forgetRate == 0:
+                hrr.accumulate(T, corr, n * self.dt / self.stepsize * self.inputScale)
+            else:
+                #n steps of the update with a constant input, in closed form
+                decay = leak**n
+                T = hrr.weightedSum(T, decay, corr, (1.0 - decay) * self.inputScale / self.forgetRate)
+
+        return hrr.toList(T)
+
+    def calcLast(self, time=None):
+        """Returns the hypothesis for the blank cell at the given time."""
+
+        return RPMutils.cconv(self.secondLast, self.calcT(time))
+
+    def scores(self, time=None):
+        """Returns the score of each of the 8 answers at the given time."""
+
+        hypothesis = self.calcLast(time)
+        return [self.scaleFactor * hrr.dot(hypothesis, ans) for ans in self.answers]
+
+    def answer(self, time=None):
+        """Returns the index of the chosen answer and its score."""
+
+        scores = self.scores(time)
+        best = scores.index(max(scores))
+        return best, scores[best]
@@ -8,6 +8,8 @@ from ca.nengo.model.impl import NetworkImpl
 import math
 
 from misc import RPMutils
+from misc import sparse
+from networks import ensemblearray
 
 class NetworkEnsemble(NetworkImpl):
     def __init__(self, ef):
@@ -38,7 +40,7 @@ class NetworkEnsemble(NetworkImpl):
         Main.addNode(pop)
         
         for i in range(numin):
-            pop.addDecodedTermination("in_" + str(i), matrices[i], tauPSC, False)
+            pop.addDecodedTermination("in_" + str(i), sparse.dense(matrices[i]), tauPSC, False)
             Main.exposeTermination(pop.getTermination("in_" + str(i)), "in_" + str(i))
                                    
         if outputfuncs != None:
@@ -52,23 +54,27 @@ class NetworkEnsemble(NetworkImpl):
     def makeNetwork(self, name, N, tauPSC, matrices, outputfuncs):
         """Create a network ensemble that splits by dimension."""
         
+        numin = len(matrices) #number of inputs
+        dout = len(matrices[0]) #dimension of output
+        
+        smallN = int(math.ceil(float(N)/dout)) #neurons per population
+        
+        if RPMutils.COLLAPSE_RELAYS:
+            return self.makeArray(name, smallN, tauPSC, matrices, outputfuncs)
+        
         Main = NetworkImpl()
         Main.name = name
         
-        numin = len(matrices) #number of inputs
         din = [0 for i in range(numin)] #dimension of each input
         for i in range(numin):
             din[i] = len(matrices[i][0])
-            
-        dout = len(matrices[0]) #dimension of output
         
-        smallN = int(math.ceil(float(N)/dout)) #neurons per population
         defef = RPMutils.defaultEnsembleFactory()
         
         #create input populations (just relay nodes)
         inputs = []
         for i in range(numin):
-            inputs = inputs + [defef.make("in_" + str(i), 1, din[i])]
+            inputs.append(defef.make("in_" + str(i), 1, din[i]))
             inputs[i].addDecodedTermination("input", RPMutils.eye(din[i],1), 0.0001, False)
             Main.exposeTermination(inputs[i].getTermination("input"), "in_" + str(i))
             Main.addNode(inputs[i])
@@ -84,9 +90,10 @@ class NetworkEnsemble(NetworkImpl):
         
         resultTerm = [[0] for x in range(dout)]
         
-        #create dimension populations
+        #create dimension populations (rows of structured matrices are only made dense here,
+        #one at a time)
         for i in range(dout):
-            pop = self.ef.make("mid_" + str(i), smallN, 1)
+            pop = RPMutils.makeFromTemplate(self.ef, "mid_" + str(i), smallN, 1)
             Main.addNode(pop)
             
             for j in range(numin):
@@ -103,4 +110,31 @@ class NetworkEnsemble(NetworkImpl):
                 pop.addDecodedOrigin("output", [outputfuncs[i]], "AXON")
                 Main.addProjection(pop.getOrigin("output"), output.getTermination("in_" + str(i)))
             
-        return Main
\ No newline at end of file
+        return Main
+    
+    def makeArray(self, name, smallN, tauPSC, matrices, outputfuncs):
+        """Create a network ensemble that splits by dimension, without any relay populations
+        (the dimension populations are in an array that takes the inputs and gives the output)."""
+        
+        numin = len(matrices)
+        dout = len(matrices[0])
+        
+        Main = NetworkImpl()
+        Main.name = name
+        
+        mid = ensemblearray.makeArray("mid", self.ef, dout, smallN, prefix="mid_")
+        Main.addNode(mid)
+        
+        #each population gets its row of each input matrix
+        for j in range(numin):
+            mid.addDecodedTermination("in_" + str(j), sparse.dense(matrices[j]), tauPSC, False)
+            Main.exposeTermination(mid.getTermination("in_" + str(j)), "in_" + str(j))
+        
+        if outputfuncs == None:
+            Main.exposeOrigin(mid.getOrigin("X"), "X")
+        else:
+            for i in range(dout):
+                mid.getNode("mid_" + str(i)).addDecodedOrigin("output", [outputfuncs[i]], "AXON")
+            Main.exposeOrigin(ensemblearray.getOrigin(mid, "output"), "X")
+        
+        return Main
@@ -2,8 +2,16 @@
 
 
 import math
-from java.io import File
+import os
+from java.io import BufferedInputStream
+from java.io import BufferedOutputStream
+from java.io import FileInputStream
+from java.io import FileOutputStream
+from java.io import IOException
+from java.io import ObjectOutputStream
+from java.lang import ClassNotFoundException
 from java.lang import System
+from org.python.util import PythonObjectInputStream
 
 from ca.nengo.model import SimulationMode
 from ca.nengo.model import Units
@@ -18,6 +26,10 @@ from networks import transform
 from networks import similarity
 from networks import cconv
 
+#version of the snapshot format (bump to invalidate existing snapshots; changes to the code
+#that builds the network are also part of the snapshot key, see RPMutils.codeVersion)
+SNAPSHOT_VERSION = 2
+
 class SequenceSolver(NetworkImpl):
     def __init__(self, N, d, matrix):
         NetworkImpl.__init__(self)
@@ -82,13 +94,8 @@ class SequenceSolver(NetworkImpl):
             self.addNode(testSimilarity)
             
             self.addProjection(calcLast.getOrigin("X"), testSimilarity.getTermination("hypothesis"))
-            self.simulator.addProbe("testSimilarity", "result", True)
         
-        if RPMutils.USE_CLEANUP:
-            Tprobe = self.simulator.addProbe("cleanT", "clean", True)
-        else:
-            Tprobe = self.simulator.addProbe("calcT", "T", True)
-        answerprobe = self.simulator.addProbe("calcLast", "X", True)
+        Tprobe, answerprobe = self.addProbes()
         
         
         if RPMutils.USE_CLEANUP and RPMutils.DYNAMIC_MEMORY:
@@ -101,76 +108,36 @@ class SequenceSolver(NetworkImpl):
         self.setMode(RPMutils.SIMULATION_MODE)
 
     
+    def addProbes(self):
+        """Adds the probes on the rule, the hypothesis and (if not running with the controller)
+        the answer scores. Returns the rule and hypothesis probes."""
+        
+        if not RPMutils.RUN_WITH_CONTROLLER:
+            self.simulator.addProbe("testSimilarity", "result", True)
+        
+        if RPMutils.USE_CLEANUP:
+            Tprobe = self.simulator.addProbe("cleanT", "clean", True)
+        else:
+            Tprobe = self.simulator.addProbe("calcT", "T", True)
+        answerprobe = self.simulator.addProbe("calcLast", "X", True)
+        
+        return Tprobe, answerprobe
+    
     def loadSequenceMatrix(self, cell):
         """Load a matrix in HRR vector format from a file and create corresponding output functions."""
         
-        d = len(cell[0])
+        fA, fB, fLast = self.sequenceFunctions(cell)
         discontinuities = [RPMutils.STEP_SIZE, 2*RPMutils.STEP_SIZE, 3*RPMutils.STEP_SIZE, 4*RPMutils.STEP_SIZE, 5*RPMutils.STEP_SIZE]
-        values1 = [[0 for x in range(6)] for x in range(d)]
-        values2 = [[0 for x in range(6)] for x in range(d)]
         
-        
-        #         1.0       2.0      3.0      4.0
-        #signal A
-        #    cell1    cell2    cell4    cell5    cell7
-        #signal B
-        #    cell2    cell3    cell5    cell6    cell8
-        
-        #values for 0th timestep
-        for i in range(d):
-            values1[i][0] = cell[0][i]
-        for i in range(d):
-            values2[i][0] = cell[1][i]
-            
-        #values for 1st timestep
-        for i in range(d):
-            values1[i][1] = cell[1][i]
-        for i in range(d):
-            values2[i][1] = cell[2][i]
-            
-        #values for 2nd timestep
-        for i in range(d):
-            values1[i][2] = cell[3][i]
-        for i in range(d):
-            values2[i][2] = cell[4][i]
-            
-        #values for 3rd timestep
-        for i in range(d):
-            values1[i][3] = cell[4][i]
-        for i in range(d):
-            values2[i][3] = cell[5][i]
-        
-        #values for 4th timestep
-        for i in range(d):
-            values1[i][4] = cell[6][i]
-        for i in range(d):
-            values2[i][4] = cell[7][i]
-            
-        for i in range(d):
-            values1[i][5] = 0
-            values2[i][5] = 0
-            
-        #create signalA
-        f = []
-        for i in range(d):
-            f = f + [PiecewiseConstantFunction(discontinuities, values1[i])]
-        sigA = FunctionInput("sigA", f, Units.UNK)
-        
-        #create signal B
-        f = []
-        for i in range(d):
-            f = f + [PiecewiseConstantFunction(discontinuities, values2[i])]
-        sigB = FunctionInput("sigB", f, Units.UNK)
+        sigA = FunctionInput("sigA", fA, Units.UNK)
+        sigB = FunctionInput("sigB", fB, Units.UNK)
         
         #create signal for adaptive learning rate
         rates = [1.0, 1.0/2.0, 1.0/3.0, 1.0/4.0, 1.0/5.0, 0.0]
         lrate = FunctionInput("lrate", [PiecewiseConstantFunction(discontinuities, rates)], Units.UNK)
         
         #create signal for second last cell
-        f = []
-        for i in range(d):
-            f = f + [ConstantFunction(1, cell[7][i])]
-        secondLast = FunctionInput("secondLast", f, Units.UNK)
+        secondLast = FunctionInput("secondLast", fLast, Units.UNK)
         
         #load rule signal from file
         rulesig = []
@@ -189,64 +156,52 @@ class SequenceSolver(NetworkImpl):
             return([sigA, sigB, lrate, secondLast] + rulesig)
         else:
             #create signals for answers
-            ans = []
-            for i in range(8):
-                ans = ans + [cell[8+i]]
+            ans = [cell[8+i] for i in range(8)]
                 
             return([sigA, sigB, lrate, secondLast] + ans + rulesig)
     
-    
-    def reload(self, matrix):
-        """Reload network with new matrix information."""
+    def sequenceFunctions(self, cell):
+        """Returns the functions (one per dimension) for the sigA, sigB and secondLast inputs."""
         
-        N = self.N
-        d = self.d
-        
-        if RPMutils.LOAD_RULES:
-            System.out.println("Warning, calling reload when LOAD_RULES is True")
+        d = len(cell[0])
+        discontinuities = [RPMutils.STEP_SIZE, 2*RPMutils.STEP_SIZE, 3*RPMutils.STEP_SIZE, 4*RPMutils.STEP_SIZE, 5*RPMutils.STEP_SIZE]
         
-        #reload matrix data
-        matrixData = self.loadSequenceMatrix(matrix)
+        #         1.0       2.0      3.0      4.0
+        #signal A
+        #    cell1    cell2    cell4    cell5    cell7
+        #signal B
+        #    cell2    cell3    cell5    cell6    cell8
+        #(and both are 0 after the 5th timestep)
+        cellsA = [cell[0], cell[1], cell[3], cell[4], cell[6]]
+        cellsB = [cell[1], cell[2], cell[4], cell[5], cell[7]]
         
-        #remove and re-add input signals
-        self.removeProjection(self.getNode("calcT").getTermination("A"))
-        self.removeProjection(self.getNode("calcT").getTermination("B"))
-#        self.removeProjection(self.getNode("calcT").getTermination("lrate"))
-        self.removeNode("sigA")
-        self.removeNode("sigB")
-#        self.removeNode("lrate")
+        fA = [PiecewiseConstantFunction(discontinuities, [c[i] for c in cellsA] + [0]) for i in range(d)]
+        fB = [PiecewiseConstantFunction(discontinuities, [c[i] for c in cellsB] + [0]) for i in range(d)]
+        fLast = [ConstantFunction(1, cell[7][i]) for i in range(d)]
         
-        Ain = matrixData[0]
-        Bin = matrixData[1]
-#        lrate = matrixData[2]
-        self.addNode(Ain)
-        self.addNode(Bin)
-#        self.addNode(lrate)
-        self.addProjection(Ain.getOrigin("origin"), self.getNode("calcT").getTermination("A"))
-        self.addProjection(Bin.getOrigin("origin"), self.getNode("calcT").getTermination("B"))
-#        self.addProjection(lrate.getOrigin("origin"), self.getNode("calcT").getTermination("lrate"))
+        return fA, fB, fLast
+    
+    def reload(self, matrix):
+        """Reload network with new matrix information.
         
-        #remove and re-add secondLast signal
-        self.removeProjection(self.getNode("calcLast").getTermination("A"))
-        self.removeNode("secondLast")
+        Only the values of the input functions and the answer vectors in the similarity
+        network change, so the existing nodes (and their decoders) are kept and updated
+        in place rather than rebuilt."""
         
-        secondLast = matrixData[3]
-        self.addNode(secondLast)
-        self.addProjection(secondLast.getOrigin("origin"), self.getNode("calcLast").getTermination("A"))
+        if RPMutils.LOAD_RULES:
+            System.out.println("Warning, calling reload when LOAD_RULES is True")
         
+        #swap the new values into the input signals
+        fA, fB, fLast = self.sequenceFunctions(matrix)
+        self.getNode("sigA").setFunctions(fA)
+        self.getNode("sigB").setFunctions(fB)
+        self.getNode("secondLast").setFunctions(fLast)
         
-        #remove and re-add similarity network
+        #update the answers in the similarity network
         if not RPMutils.RUN_WITH_CONTROLLER:
-            self.removeProjection(self.getNode("testSimilarity").getTermination("hypothesis"))
-            probes = RPMutils.findMatchingProbes(self.simulator.getProbes(), "testSimilarity")
-            for probe in probes:
-                self.simulator.removeProbe(probe)
-            self.removeNode("testSimilarity")
-            
-            testSimilarity = similarity.Similarity("testSimilarity", N, d, matrixData[4:])
-            self.addNode(testSimilarity)
-            self.addProjection(self.getNode("calcLast").getOrigin("X"), testSimilarity.getTermination("hypothesis"))
-            self.simulator.addProbe("testSimilarity", "result", True)
+            testSimilarity = self.getNode("testSimilarity")
+            testSimilarity.setAnswers(matrix[8:16])
+            testSimilarity.simulator.resetProbes()
         
         if RPMutils.USE_CLEANUP:
             #call reload on memory network, which will reload cleanup memory
@@ -259,4 +214,71 @@ class SequenceSolver(NetworkImpl):
         #reset all probes
         self.simulator.resetProbes()
         
-        self.setMode(RPMutils.SIMULATION_MODE)
\ No newline at end of file
+        self.setMode(RPMutils.SIMULATION_MODE)
+
+def saveSnapshot(solver, filename):
+    """Saves a built SequenceSolver (neurons, decoders, terminations and all) to file (returns
+    False if it could not be saved)."""
+    
+    def write(tmpname):
+        output = ObjectOutputStream(BufferedOutputStream(FileOutputStream(tmpname)))
+        try:
+            output.writeInt(SNAPSHOT_VERSION)
+            output.writeObject(solver)
+        finally:
+            output.close()
+    
+    #a network that can't be serialized (e.g. one containing Python nodes that Java
+    #serialization doesn't support) is just not saved, with a warning
+    return RPMutils.writeAtomically(filename, write)
+
+def loadSnapshot(filename):
+    """Loads a SequenceSolver saved with saveSnapshot (returns None if there is no valid snapshot)."""
+    
+    if not os.path.exists(filename):
+        return None
+    
+    #PythonObjectInputStream can resolve the classes of Python subclasses of Nengo objects
+    input = PythonObjectInputStream(BufferedInputStream(FileInputStream(filename)))
+    try:
+        try:
+            if input.readInt() != SNAPSHOT_VERSION:
+                return None
+            solver = input.readObject()
+        except (IOException, ClassNotFoundException), e:
+            System.err.println("Warning, could not load network snapshot " + filename + ": " + str(e))
+            return None
+    finally:
+        input.close()
+    
+    if len(solver.simulator.getProbes()) == 0:
+        solver.addProbes()
+    
+    return solver
+
+def makeSequenceSolver(N, d, matrix, seed):
+    """Returns a SequenceSolver for the given (encoded) matrix.
+    
+    If USE_SNAPSHOTS is set, a network built for the same N, d, vocabulary seed and structural
+    parameters is loaded from its snapshot and given the new matrix inputs; otherwise a new
+    network is built (and, with USE_SNAPSHOTS, saved for next time)."""
+    
+    if not RPMutils.USE_SNAPSHOTS or RPMutils.LOAD_RULES or RPMutils.RUN_WITH_CONTROLLER:
+        #rules are read from file and the controller's listeners write to this job's files
+        #when the network is built, so those networks can't be reused
+        return SequenceSolver(N, d, matrix)
+    
+    if RPMutils.SIMULATION_MODE == SimulationMode.DIRECT:
+        #in DIRECT mode the networks are made of direct nodes (see directnode), which can't
+        #be loaded from a snapshot. there are no decoders to solve, so they are quick to build anyway
+        return SequenceSolver(N, d, matrix)
+    
+    filename = RPMutils.snapshotFile("SequenceSolver", N, d, seed)
+    solver = loadSnapshot(filename)
+    if solver != None:
+        solver.reload(matrix)
+        return solver
+    
+    solver = SequenceSolver(N, d, matrix)
+    saveSnapshot(solver, filename)
+    return solver
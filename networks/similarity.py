@@ -20,12 +20,14 @@ class Similarity(NetworkImpl):
         ef1 = RPMutils.defaultEnsembleFactory()
         ef1.nodeFactory.tauRef = 0.001
         
-        test = ef1.make("hypothesis", 1, d)
-        test.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
-        test.fixMode()
-        test.addDecodedTermination("input", RPMutils.eye(d,1), 0.0001, False)
-        self.addNode(test)
-        self.exposeTermination(test.getTermination("input"), "hypothesis")
+        collapse = RPMutils.COLLAPSE_RELAYS
+        if not collapse:
+            test = ef1.make("hypothesis", 1, d)
+            test.setMode(SimulationMode.DIRECT) #since this is just a relay ensemble for modularity
+            test.fixMode()
+            test.addDecodedTermination("input", RPMutils.eye(d,1), 0.0001, False)
+            self.addNode(test)
+            self.exposeTermination(test.getTermination("input"), "hypothesis")
         
         
         combine = ef1.make("combine", 800, 8)
@@ -42,7 +44,8 @@ class Similarity(NetworkImpl):
             ans.addDecodedTermination("input", [vocab[i]], tauPSC, False)
             self.addNode(ans)
             
-            self.addProjection(test.getOrigin("X"), ans.getTermination("input"))
+            if not collapse:
+                self.addProjection(test.getOrigin("X"), ans.getTermination("input"))
             
             inputVec[i] = [scaleFactor]
             combine.addDecodedTermination("in_" + str(i), inputVec, tauPSC, False)
@@ -51,8 +54,18 @@ class Similarity(NetworkImpl):
             self.addProjection(ans.getOrigin("X"), combine.getTermination("in_" + str(i)))
             
         
+        if collapse:
+            RPMutils.exposeTerminations(self, [self.getNode("ans_" + str(i)).getTermination("input") for i in range(8)], "hypothesis")
         self.exposeOrigin(combine.getOrigin("X"), "result")
         
         if RPMutils.USE_PROBES:
             self.simulator.addProbe("combine", "X", True)
+    
+    def setAnswers(self, vocab):
+        """Replaces the answer vectors, by rewriting the input weights of the answer populations in place."""
+        
+        for i in range(8):
+            transform = self.getNode("ans_" + str(i)).getTermination("input").getTransform()
+            for j,x in enumerate(vocab[i]):
+                transform[0][j] = x
         
\ No newline at end of file
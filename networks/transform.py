@@ -5,6 +5,7 @@ import math
 from ca.nengo.model.impl import NetworkImpl
 
 from misc import RPMutils
+from misc import sparse
 from networks import networkensemble
 from networks import cconv
 from networks import average
@@ -19,18 +20,14 @@ class Transform(NetworkImpl):
         ef = RPMutils.defaultEnsembleFactory()
         netef = networkensemble.NetworkEnsemble(ef)
         
-        #create the approximate inverse matrix
-        inv = RPMutils.eye(d, 1)
-        for i in range(d/2):
-            tmp = inv[i+1]
-            inv[i+1] = inv[d-i-1]
-            inv[d-i-1] = tmp
+        #create the approximate inverse matrix (which reverses all but the first element)
+        inv = sparse.permutation([-i % d for i in range(d)])
         
         #create the two input populations
         Ainv = netef.make("Ainv", N, tauPSC, [inv], None)
         self.addNode(Ainv)
         
-        B = netef.make("B", N, tauPSC, [RPMutils.eye(d, 1)], None)
+        B = netef.make("B", N, tauPSC, [sparse.identity(d)], None)
         self.addNode(B)
           
         #create circular convolution network
@@ -13,12 +13,13 @@ numwords = RPMutils.VOCAB_SIZE
 seed = 107
 RPMutils.CURR_LOCATION = os.path.dirname(scriptname)
 RPMutils.RUN_WITH_CONTROLLER = False
+RPMutils.setThreads()
 
 
 vocab = vocabulary.genVocab(d, numwords, seed)
 
 mhandler = matrixhandler.MatrixHandler(RPMutils.CURR_LOCATION + "\sequencematrix_1.txt", vocab)
 
-test = sequencesolver.SequenceSolver(N, d, mhandler.encodeMatrix(mhandler.getMatrix()) + mhandler.encodeMatrix(mhandler.getAnswers()))
+test = sequencesolver.makeSequenceSolver(N, d, mhandler.encodeAll(), seed)
 
 world.add(test)
\ No newline at end of file